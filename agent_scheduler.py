@@ -0,0 +1,149 @@
+import time
+import asyncio
+from collections import deque
+
+
+class AgentScheduler:
+    """Runs agent windows on a bounded number of asyncio workers.
+
+    Each call has its own queue of pending windows. When a newer window for the same call
+    arrives while older ones are still queued, the stale windows are dropped or merged into
+    the newer one (latest window wins), so results never pile up behind a fast talker.
+    """
+    def __init__(
+        self,
+        handler,
+        max_workers: int = 2,
+        queue_depth: int = 1,
+        max_pending: int = 8,
+        stale_policy: str = "drop",
+    ):
+        if stale_policy not in ("drop", "merge"):
+            raise ValueError(f"Unknown stale window policy: {stale_policy}")
+        self.handler = handler
+        self.max_workers = max_workers
+        self.queue_depth = max(1, queue_depth)
+        self.max_pending = max(1, max_pending)
+        self.stale_policy = stale_policy
+        self.queue_waits = []
+        self.dropped_windows = 0
+        self.merged_windows = 0
+        self.rejected_windows = 0
+        self._pending = {}  # call id -> deque of queued windows
+        self._ready_calls = deque()  # round-robin order of calls with pending windows
+        self._n_pending = 0
+        self._closed = False
+        self._condition = asyncio.Condition()
+
+    async def submit(self, call_id, window: dict, block: bool = True, timeout: float | None = None) -> bool:
+        """Queue a window for a call.
+
+        When the call already has `queue_depth` windows queued, they are stale: they are dropped
+        or merged into the new window. When `max_pending` windows are queued across all calls,
+        the producer waits for a free slot (backpressure), or the window is rejected if `block`
+        is False or `timeout` expires.
+
+        Returns:
+            bool: Whether the window was queued.
+        """
+        window = dict(window, queued_at=time.perf_counter())
+        async with self._condition:
+            if self._closed:
+                return False
+            pending = self._pending.setdefault(call_id, deque())
+            coalesced = len(pending) >= self.queue_depth
+            if coalesced:
+                window = self._coalesce(pending, window)
+            elif self._n_pending >= self.max_pending:
+                has_slot = False
+                if block:
+                    try:
+                        has_slot = await asyncio.wait_for(
+                            self._condition.wait_for(lambda: self._closed or self._n_pending < self.max_pending),
+                            timeout=timeout,
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                if not has_slot or self._closed:
+                    self.rejected_windows += 1
+                    return False
+            # A coalesced call is still in the ready order from its stale windows
+            if not coalesced and not pending:
+                self._ready_calls.append(call_id)
+            pending.append(window)
+            self._n_pending += 1
+            self._condition.notify_all()
+            return True
+
+    def _coalesce(self, pending: deque, window: dict) -> dict:
+        """Fold the stale queued windows of a call into the newest one"""
+        stale = list(pending)
+        pending.clear()
+        self._n_pending -= len(stale)
+        if self.stale_policy == "merge":
+            self.merged_windows += len(stale)
+            texts = [w['text'] for w in stale] + [window['text']]
+            window['text'] = merge_overlapping(texts)
+            if 'retrieval_set' in window:
+                window['retrieval_set'] = window['retrieval_set'].union(*(w.get('retrieval_set', ()) for w in stale))
+            # The merged window has been waiting since its oldest part was queued
+            window['queued_at'] = stale[0]['queued_at']
+        else:
+            self.dropped_windows += len(stale)
+        return window
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._closed or self._ready_calls)
+                if not self._ready_calls:
+                    return
+                call_id = self._ready_calls.popleft()
+                pending = self._pending[call_id]
+                window = pending.popleft()
+                self._n_pending -= 1
+                if pending:
+                    self._ready_calls.append(call_id)
+                self._condition.notify_all()
+
+            queue_wait = time.perf_counter() - window['queued_at']
+            self.queue_waits.append(queue_wait)
+            try:
+                await self.handler(call_id, window, queue_wait)
+            except Exception as e:
+                print(f"Error in agent worker: {e}")
+
+    async def run(self):
+        """Process windows until the scheduler is closed and every queued window is done"""
+        await asyncio.gather(*(self._worker() for _ in range(self.max_workers)))
+
+    async def close(self):
+        """Stop accepting windows; workers exit once the queued ones are processed"""
+        async with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """Queue wait and coalescing statistics"""
+        waits = sorted(self.queue_waits)
+        return {
+            'windows_processed': len(waits),
+            'windows_dropped': self.dropped_windows,
+            'windows_merged': self.merged_windows,
+            'windows_rejected': self.rejected_windows,
+            'queue_wait_mean': sum(waits) / len(waits) if waits else 0.0,
+            'queue_wait_max': waits[-1] if waits else 0.0,
+        }
+
+
+def merge_overlapping(texts: list[str]) -> str:
+    """Join consecutive windows of utterances, keeping the lines they overlap on only once"""
+    merged = texts[0].split("\n")
+    for text in texts[1:]:
+        lines = text.split("\n")
+        overlap = next(
+            (n for n in range(min(len(merged), len(lines)), 0, -1) if merged[-n:] == lines[:n]),
+            0,
+        )
+        merged.extend(lines[overlap:])
+    return "\n".join(merged)
@@ -1,20 +1,19 @@
 import streamlit as st
-from bank_call_agent import AssistantAgent
-import dspy
-import mlflow
+from bank_call_agent import AgentRuntime, build_response_cache, get_config, get_embedding_function, start_background_warm_up
 import subprocess
 import webbrowser
 import time
 import threading
 from dotenv import load_dotenv
-import os
-import dspy
 from dspy.utils.callback import BaseCallback
 import json
-from streamlit.runtime.scriptrunner import add_script_run_ctx
+import asyncio
 from datetime import datetime
-import yaml
-from stt import recognize_from_file, transcription_manager
+from call_session import CallSession, call_registry
+from stt import audio_source
+from results_view import ResultsFeed
+from lexical_index import HybridRM
+from metrics import start_metrics_server
 load_dotenv()
 
 # Custom callback for displaying thoughts and actions
@@ -40,16 +39,48 @@ class AgentLoggingCallback(BaseCallback):
                         `{outputs['next_tool_name']}` args: `{args_str}`"""
                     )
 
-def dspy_configure(model_deployment_name, temperature=0.0):
-    st.session_state.lm = dspy.LM(
-        model=f"azure/{model_deployment_name}",
-        api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-        api_base=os.getenv('AZURE_OPENAI_API_BASE'),
-        api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
+@st.cache_resource
+def load_mlflow():
+    # Imported on first use rather than on the first page load; autologging is process-wide
+    import mlflow
+    mlflow.dspy.autolog()
+    return mlflow
+
+@st.cache_resource
+def start_warm_up():
+    # Once per process, while the UI is already interactive: build the agent resources and load MLflow;
+    # a click on Analyze meanwhile waits for this load instead of starting another
+    threading.Thread(target=load_mlflow, name="MlflowImport", daemon=True).start()
+    return start_background_warm_up()
+
+@st.cache_resource
+def start_metrics_endpoint():
+    # One local metrics server per process, serving the latency of the latest calls
+    port = config.get('metrics_port')
+    return start_metrics_server(port) if port else None
+
+@st.cache_resource
+def load_response_cache():
+    # Shared by every session of the process, like the embedding cache
+    return build_response_cache()
+
+def start_agent_runtime():
+    """Build the session-scoped agent runtime once, when the analysis starts"""
+    start_metrics_endpoint()
+    st.session_state.agent_runtime = AgentRuntime(
+        model_deployment_name=model_deployment_name,
         temperature=temperature,
-        cache=False,
+        results_from_search=n_results,
+        similarity_threshold=similarity_threshold,
+        callbacks=[AgentLoggingCallback()],
+        client_id=client_id or None,
+        agent_mode=agent_mode,
     )
-    dspy.configure(lm=st.session_state.lm, callbacks=[AgentLoggingCallback()])
+    if call_budget:
+        st.session_state.agent_runtime.set_budget(
+            call_budget, fallback=budget_fallback, fallback_deployment=config.get('budget_fallback_deployment')
+        )
+    return st.session_state.agent_runtime
 
 def launch_mlflow():
     if not st.session_state.mlflow_launched:
@@ -64,91 +95,76 @@ def launch_mlflow():
         display_results()
 
 def display_results():
+    # Full render, only when the placeholder is new; results are then added one card at a time
     st.session_state.results_placeholder.empty()
-    with st.session_state.results_placeholder.container():
-        st.session_state.results_list.sort(key=lambda x: x['timestamp'], reverse=True)
-        for i, result in enumerate(st.session_state.results_list):
-            st.subheader(f"ℹ️ Relevant Information {len(st.session_state.results_list) - i}")
-            st.text(result['prediction'].relevant_information)
-            
-            st.subheader("📚 References")
-            st.text(result['prediction'].citations)
-            
-            with st.expander("💬 View Agent Input", expanded=False):
-                st.text(result['input_text'])
+    st.session_state.results_feed.mount(st.session_state.results_placeholder)
 
-            with st.expander("💭 View Reasoning", expanded=False):
-                st.text(result['prediction'].reasoning)
-            
-            with st.expander("🔍 View Trajectory", expanded=False):
-                st.write(result['prediction'].trajectory)
-            
+def display_streaming_results():
+    # Answers of the windows the agent is still generating, above the finished results
+    with st.session_state.streaming_placeholder.container():
+        for timestamp, fields in sorted(st.session_state.streaming_results.items(), reverse=True):
+            st.subheader("✍️ Relevant Information (generating...)")
+            st.text(fields['relevant_information'])
+            if fields['citations']:
+                st.subheader("📚 References")
+                st.text(fields['citations'])
             st.markdown("---")
 
+def stream_token(window, field, text):
+    fields = st.session_state.streaming_results.setdefault(
+        window['timestamp'], {'relevant_information': "", 'citations': ""}
+    )
+    fields[field] += text
+    display_streaming_results()
+
+def finish_streaming(window):
+    # Every finished window drops its streaming card, also when its result is suppressed or the agent failed
+    if st.session_state.streaming_results.pop(window['timestamp'], None) is not None:
+        display_streaming_results()
+
+def publish_result(result):
+    runtime = st.session_state.agent_runtime
+    prediction = result['prediction']
+    if result['time_to_first_token'] is not None:
+        print(f"time to first token: {result['time_to_first_token']:.2f}s")
+    if not result['cached']:
+        usage = result['usage']
+        print(f"window: {usage['lm_calls']} LM calls, {usage['prompt_tokens']} + {usage['completion_tokens']} tokens, ${usage['cost']:.4f}")
+    print(f"call agent cost: {runtime.usage.cost}")
+
+    if prediction.relevant_information != "Waiting for more information":
+        print(f"Found relevant information")
+        st.session_state.results_feed.add({
+            'prediction': prediction,
+            'input_text': result['text'],
+            'timestamp': result['timestamp'],
+            'queue_wait': result['queue_wait']
+        })
+
 def transcriber_callback(transcription):
     # Create a sidebar for live transcription if it doesn't exist
     if 'live_transcription_container' not in st.session_state:
+        st.sidebar.markdown("* 📝 Live Transcription *")
+        st.session_state.final_transcription_container = st.sidebar.container()
         st.session_state.live_transcription_container = st.sidebar.empty()
     
     # Handle different transcription types
     if transcription['type'] == 'interim':
-        # Update the live transcription display with interim results
+        # Only the interim line is re-rendered, so each update costs the same however long the call is
         st.session_state.live_transcription = f"Speaker {transcription['speaker_id']}: {transcription['text']}"
-        with st.session_state.live_transcription_container:
-            st.text(
-                f"""* 📝 Live Transcription *
-                {st.session_state.final_transcription}
-                {st.session_state.live_transcription}"""
-            )
+        st.session_state.live_transcription_container.text(st.session_state.live_transcription)
+        st.session_state.agent_runtime.on_interim(transcription['text'])
     
     elif transcription['type'] == 'final':
-        def run_agent(text, timestamp):
-            lm = dspy.LM(
-                model=f"azure/{model_deployment_name}",
-                api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-                api_base=os.getenv('AZURE_OPENAI_API_BASE'),
-                api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
-                temperature=temperature,
-                cache=False,
-            )
-            dspy.configure(lm=lm, callbacks=[AgentLoggingCallback()])
-            mlflow.dspy.autolog()
-            agent = AssistantAgent(similarity_threshold=similarity_threshold, results_from_search=n_results)
-            prediction = agent(transcribed_text=text)
-            st.session_state.agent_cost += lm.history[-1]['cost']
-            print(f"total agent cost: {st.session_state.agent_cost}")
-            
-            if prediction.relevant_information != "Waiting for more information":
-                print(f"Found relevant information")
-                st.session_state.results_list.append({
-                    'prediction': prediction,
-                    'input_text': text,
-                    'timestamp': timestamp
-                })
-                display_results()
-
-        # Concatenate final transcription and update display
+        # Append the final utterance to the transcript and clear the interim line
         final_utterance = f"Speaker {transcription['speaker_id']}: {transcription['text']}"
         st.session_state.final_transcription += f"\n{final_utterance}\n"
+        st.session_state.final_transcription_container.text(final_utterance)
         st.session_state.live_transcription = ""  # Clear interim transcription
+        st.session_state.live_transcription_container.empty()
         
         print(f"got utterance: {transcription['text']}")
 
-        st.session_state.utterance_buffer.append(final_utterance)
-        if len(st.session_state.utterance_buffer) >= transcription_buffer_size:
-            text = "\n".join(st.session_state.utterance_buffer[-transcription_buffer_size:])
-            st.session_state.utterance_buffer = st.session_state.utterance_buffer[-transcription_buffer_overlap:]
-
-            print(f"running agent with text: {text}")
-        
-            thread = threading.Thread(
-                target=run_agent, 
-                args=(text, datetime.now(),)
-            )
-            add_script_run_ctx(thread)
-            thread.start()
-            agent_threads.append(thread)
-
 # Initialize session states
 if 'live_transcription' not in st.session_state:
     st.session_state.live_transcription = ""
@@ -158,25 +174,23 @@ if 'analysis_complete' not in st.session_state:
     st.session_state.analysis_complete = False
 if 'mlflow_launched' not in st.session_state:
     st.session_state.mlflow_launched = False
-if 'results_list' not in st.session_state:
-    st.session_state.results_list = []
+if 'results_feed' not in st.session_state:
+    st.session_state.results_feed = ResultsFeed()
 if 'thought_container' not in st.session_state:
     st.session_state.thought_container = st.empty()
 if 'results_placeholder' not in st.session_state:
     st.session_state.results_placeholder = st.empty()
+if 'streaming_results' not in st.session_state:
+    st.session_state.streaming_results = {}
 if 'agent_cost' not in st.session_state:
     st.session_state.agent_cost = 0
-if 'lm' not in st.session_state:
-    st.session_state.lm = None
+if 'agent_runtime' not in st.session_state:
+    st.session_state.agent_runtime = None
 if 'mlflow_experiment_started' not in st.session_state:
     st.session_state.mlflow_experiment_started = False
-if 'utterance_buffer' not in st.session_state:
-    st.session_state.utterance_buffer = []
-
-with open('config.yaml', 'r') as file:
-    config = yaml.safe_load(file)
 
-agent_threads = []
+config = get_config()
+start_warm_up()
 
 st.title("Call Assistant 📳 🤖")
 
@@ -195,9 +209,6 @@ if input_method == "Upload audio file":
     if uploaded_file is not None:
         # Display audio player
         st.audio(uploaded_file, format=f'audio/{uploaded_file.type.split("/")[1]}')
-        # Save the uploaded file temporarily
-        with open("temp_audio.wav", "wb") as f:
-            f.write(uploaded_file.read())
 else:
     transcribed_text = st.text_area("📝 Enter or paste text:", height=150)
 
@@ -218,66 +229,186 @@ with st.expander("Configuration", expanded=True, icon="⚙️"):
         transcription_buffer_size = st.number_input("Transcription Buffer Size", min_value=1, max_value=10, value=4, step=1)
     with col2:
         transcription_buffer_overlap = st.number_input("Transcription Buffer Overlap", min_value=0, max_value=10, value=2, step=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        max_agent_workers = st.number_input("Max Agent Workers", min_value=1, max_value=10, value=2, step=1)
+    with col2:
+        agent_queue_depth = st.number_input("Queued Windows per Call", min_value=1, max_value=10, value=1, step=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        stale_window_policy = st.selectbox("Stale Window Policy", ["drop", "merge"])
+    with col2:
+        max_pending_windows = st.number_input("Max Queued Windows per Stage", min_value=1, max_value=50, value=8, step=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        speculative_retrieval = st.checkbox("Speculative Retrieval on Interim Text", value=False)
+    with col2:
+        speculative_debounce_ms = st.number_input("Interim Debounce (ms)", min_value=0, max_value=2000, value=300, step=50)
+    col1, col2 = st.columns(2)
+    with col1:
+        min_interim_interval_ms = st.number_input("Min Interim Interval (ms)", min_value=0, max_value=2000, value=200, step=50)
+    with col2:
+        retrieval_concurrency = st.number_input("Retrieval Concurrency", min_value=1, max_value=10, value=1, step=1)
+    col1, col2 = st.columns(2)
+    with col1:
+        client_id = st.text_input("Client ID", value="", help="Only search this client's notes; leave empty to search all notes").strip()
+    with col2:
+        intent_gate = st.checkbox("Skip Windows Without Intent", value=True, help="Skip the agent for greetings and small talk")
+    col1, col2 = st.columns(2)
+    with col1:
+        agent_mode = st.selectbox(
+            "Agent Mode", ["react", "single_pass"],
+            help="react: the agent picks its tools over several LM calls. single_pass: tools run up front, then one LM call"
+        )
+    with col2:
+        deduplicate = st.checkbox("Skip Repeated Results", value=True, help="Skip windows that would surface the same notes again")
+    col1, col2 = st.columns(2)
+    with col1:
+        response_cache = st.checkbox("Semantic Response Cache", value=False, help="Reuse answers of similar windows that retrieved the same notes")
+    with col2:
+        stream_output = st.checkbox("Stream Agent Output", value=True, help="Show the answer while the LM generates it")
+    col1, col2 = st.columns(2)
+    with col1:
+        call_budget = st.number_input("Cost Budget per Call ($)", min_value=0.0, value=0.0, step=0.05, help="0 for no budget")
+    with col2:
+        # Switching deployments needs a cheaper one configured in config.yaml
+        budget_fallbacks = ["single_pass"] + (["cheaper_deployment"] if config.get('budget_fallback_deployment') else [])
+        budget_fallback = st.selectbox("Over Budget", budget_fallbacks, help="How the agent gets cheaper once the budget is spent")
 
 
 if st.button("🤖 Analyze"):
     st.session_state.analysis_complete_container = st.empty()
     with st.spinner("🤖 Analyzing..."):
+        mlflow = load_mlflow()
         st.session_state.thought_container = st.empty()
         st.markdown("---")
+        st.session_state.streaming_placeholder = st.empty()
+        st.session_state.streaming_results = {}
         st.session_state.results_placeholder = st.empty()
+        display_results()
 
         if input_method == "Write or paste text" and transcribed_text:
-            dspy_configure(model_deployment_name, temperature)
-            agent = AssistantAgent(similarity_threshold=similarity_threshold, results_from_search=n_results)
+            runtime = start_agent_runtime()
             if not st.session_state.mlflow_experiment_started:
                 print("starting mlflow experiment")
-                mlflow.dspy.autolog()
                 mlflow.set_experiment("Agent Analysis")
                 st.session_state.mlflow_experiment_started = True
                 mlflow.log_params({
                     "similarity_threshold": similarity_threshold,
                     "n_results": n_results,
                     "model_deployment_name": model_deployment_name,
-                    "temperature": temperature
+                    "temperature": temperature,
+                    "client_id": client_id,
+                    "agent_mode": agent_mode
                 })
-            prediction = agent(transcribed_text=transcribed_text)
-            st.session_state.agent_cost += st.session_state.lm.history[-1]['cost']
+            prediction = runtime(transcribed_text=transcribed_text)
+            st.session_state.agent_cost += runtime.usage.cost
             
             # Add and display the result immediately
-            st.session_state.results_list.append({
+            st.session_state.results_feed.add({
                 'prediction': prediction,
                 'input_text': transcribed_text,
                 'timestamp': datetime.now()
             })
-            display_results()
             st.session_state.analysis_complete = True
             with st.session_state.analysis_complete_container:
                 st.success("✨ Analysis complete!")
 
         elif input_method == "Upload audio file" and uploaded_file:
-            transcription_manager.set_consumer_callback(transcriber_callback)
+            # Stream the upload from memory straight into the transcriber
+            try:
+                source = audio_source(uploaded_file.getvalue(), uploaded_file.name)
+            except FileNotFoundError:
+                st.error("ffmpeg is needed to decode MP3 files: install it, or upload a WAV file")
+                st.stop()
+            except ValueError as e:
+                st.error(f"Could not read {uploaded_file.name}: {e}")
+                st.stop()
+            runtime = start_agent_runtime()
+            # Warm up while the transcriber starts, so the first window is as fast as the rest
+            runtime.start_warm_up()
+            if speculative_retrieval:
+                runtime.enable_speculative_retrieval(debounce=speculative_debounce_ms / 1000)
+            if intent_gate:
+                runtime.enable_intent_gate()
+            if response_cache:
+                runtime.enable_response_cache(load_response_cache())
+            call_session = CallSession(
+                runtime,
+                on_transcription=transcriber_callback,
+                on_result=publish_result,
+                min_interim_interval=min_interim_interval_ms / 1000,
+                buffer_size=transcription_buffer_size,
+                buffer_overlap=transcription_buffer_overlap,
+                queue_size=max_pending_windows,
+                retrieval_concurrency=retrieval_concurrency,
+                reasoning_concurrency=max_agent_workers,
+                reasoning_queue_depth=agent_queue_depth,
+                stale_policy=stale_window_policy,
+                deduplicate=deduplicate,
+                on_token=stream_token if stream_output else None,
+                on_window_done=finish_streaming if stream_output else None,
+            )
+            st.session_state.call_session = call_session
             print("starting mlflow experiment")
             mlflow.set_experiment("Agent Analysis")
             mlflow.log_params({
                 "similarity_threshold": similarity_threshold,
                 "n_results": n_results,
                 "model_deployment_name": model_deployment_name,
-                "temperature": temperature
+                "temperature": temperature,
+                "max_agent_workers": max_agent_workers,
+                "agent_queue_depth": agent_queue_depth,
+                "stale_window_policy": stale_window_policy,
+                "speculative_retrieval": speculative_retrieval,
+                "retrieval_concurrency": retrieval_concurrency,
+                "client_id": client_id,
+                "intent_gate": intent_gate,
+                "agent_mode": agent_mode,
+                "deduplicate": deduplicate,
+                "response_cache": response_cache,
+                "stream_output": stream_output,
+                "call_budget": call_budget,
+                "budget_fallback": budget_fallback
             })
-            recognize_from_file("temp_audio.wav")
-            for thread in agent_threads:
-                thread.join()
+            # The call runs on this script thread and ends when its transcription session stops
+            asyncio.run(call_session.run(source))
+            # Summed over every LM call of the call, including windows whose results were not shown
+            st.session_state.agent_cost += runtime.usage.cost
             mlflow.log_metric("cost", st.session_state.agent_cost)
+            call_stats = call_session.get_stats()
+            print(f"intent gate: skipped {call_stats['gate_windows_skipped']} of {call_stats['gate_windows']} windows, "
+                  f"~{call_stats['gate_lm_calls_saved']:.0f} LM calls and ${call_stats['gate_cost_saved']:.4f} saved")
+            print(f"{agent_mode} agent: {call_stats['agent_latency_mean']:.2f}s, {call_stats['lm_calls_per_run']:.1f} LM calls "
+                  f"and ${call_stats['lm_cost_per_run']:.4f} per window")
+            print(f"LM usage: {call_stats['lm_calls']} calls, {call_stats['lm_prompt_tokens']} prompt and "
+                  f"{call_stats['lm_completion_tokens']} completion tokens, ${call_stats['lm_cost']:.4f}"
+                  + (" (over budget)" if call_stats['over_budget'] else ""))
+            print(f"deduplication: {call_stats['redundant_lm_calls_avoided']} redundant LM runs avoided, "
+                  f"{call_stats['duplicate_results_suppressed']} duplicate results suppressed")
+            mlflow.log_metrics(call_stats)
+            capacity = call_registry.get_capacity()
+            print(f"process call capacity: {capacity}")
+            mlflow.log_metrics(capacity)
+            mlflow.log_metrics(get_embedding_function().get_stats())
+            if response_cache:
+                response_cache_stats = runtime.response_cache.get_stats()
+                print(f"response cache: {response_cache_stats}")
+                mlflow.log_metrics(response_cache_stats)
+            runtime.agent.prefetch.stop()
+            prefetch_stats = runtime.agent.prefetch.get_stats()
+            print(f"retrieval prefetch: {prefetch_stats}")
+            mlflow.log_metrics(prefetch_stats)
+            if isinstance(runtime.agent.retriever, HybridRM):
+                lexical_stats = runtime.agent.retriever.get_stats()
+                print(f"lexical fast path: {lexical_stats}")
+                mlflow.log_metrics(lexical_stats)
             mlflow.end_run()
 
             st.session_state.analysis_complete = True
             with st.session_state.analysis_complete_container:
                 st.success("✨ Analysis complete!")
-            
-            # Clean up the temporary file
-            if os.path.exists("temp_audio.wav"):
-                os.remove("temp_audio.wav")
+
         elif input_method == "Write or paste text":
             st.warning("Provide some transcribed text from the call.")
         else:
@@ -1,35 +1,136 @@
-import chromadb
-import chromadb.utils.embedding_functions as embedding_functions
 import uuid
-from dspy.retrieve.chromadb_rm import ChromadbRM
 import dspy
 import os
-import mlflow
 from dspy.utils.callback import BaseCallback
 import json
+import asyncio
+import time
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 import yaml
+from numpy_retriever import NumpyRM, default_index_path
+from lexical_index import BM25Index, HybridRM, default_lexical_index_path
+from speculative_retrieval import SpeculativeRetriever
+from intent_gate import IntentGate, detect_tickers
+from concurrent.futures import ThreadPoolExecutor
+from response_cache import ResponseCache, collection_version_path, retrieval_key
+from metrics import StageTimingCallback, timed_stage
+from usage import Usage, metered, pricing_models
+from startup import init_timings, lazy_resource
 
-# Load config
-with open('config.yaml', 'r') as file:
-    config = yaml.safe_load(file)
+# Config, embedding function and retriever are built on first use rather than at import,
+# so importing this module stays cheap; chromadb is only imported by the resources using it
 
-ef = embedding_functions.OpenAIEmbeddingFunction (
-    api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    api_base=os.getenv('AZURE_OPENAI_API_BASE'),
-    api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
-    api_type='azure',
-    model_name=config.get('azure_embedding_model')
-)
+@lazy_resource
+def get_config() -> dict:
+    with open('config.yaml', 'r') as file:
+        return yaml.safe_load(file)
 
-chroma_client = chromadb.PersistentClient(path=config.get('db_persist_path'))
-retriever = ChromadbRM(
-    collection_name=config.get('db_collection_name'),
-    persist_directory=config.get('db_persist_path'),
-    embedding_function=ef,
-    client=chroma_client
-)
+@lazy_resource
+def get_embedding_function():
+    import chromadb.utils.embedding_functions as embedding_functions
+    from embedding_cache import CachedEmbeddingFunction
+    config = get_config()
+    return CachedEmbeddingFunction(
+        embedding_functions.OpenAIEmbeddingFunction(
+            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+            api_base=os.getenv('AZURE_OPENAI_API_BASE'),
+            api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
+            api_type='azure',
+            model_name=config.get('azure_embedding_model')
+        ),
+        max_size=config.get('embedding_cache_size', 1024),
+        ttl=config.get('embedding_cache_ttl_seconds'),
+        path=config.get('embedding_cache_path'),
+        namespace=config.get('azure_embedding_model'),
+    )
+
+def build_vector_retriever(backend: str | None = None):
+    """Build the vector retriever for the configured backend ('chroma' or 'numpy')"""
+    config = get_config()
+    backend = backend or config.get('retriever_backend', 'chroma')
+    if backend == 'numpy':
+        return NumpyRM(index_path=default_index_path(config), embedding_function=get_embedding_function())
+    if backend != 'chroma':
+        raise ValueError(f"Unknown retriever backend: {backend}")
+    import chromadb
+    from dspy.retrieve.chromadb_rm import ChromadbRM
+    chroma_client = chromadb.PersistentClient(path=config.get('db_persist_path'))
+    return ChromadbRM(
+        collection_name=config.get('db_collection_name'),
+        persist_directory=config.get('db_persist_path'),
+        embedding_function=get_embedding_function(),
+        client=chroma_client
+    )
+
+def build_retriever(backend: str | None = None):
+    """Build the notes retriever, fused with the BM25 index when hybrid retrieval is enabled"""
+    config = get_config()
+    retriever = build_vector_retriever(backend)
+    lexical_index_path = default_lexical_index_path(config)
+    if not config.get('hybrid_retrieval', False):
+        return retriever
+    if not os.path.exists(lexical_index_path):
+        print(f"No BM25 index at {lexical_index_path}, run prepare_vector_db.py; using vector retrieval only")
+        return retriever
+    return HybridRM(
+        retriever,
+        BM25Index.load(lexical_index_path),
+        fast_path_confidence=config.get('lexical_fast_path_confidence', 0.8),
+        min_lexical_coverage=config.get('lexical_min_coverage', 0.5),
+    )
+
+@lazy_resource
+def get_default_retriever():
+    return build_retriever()
+
+def warm_up_resources():
+    """Build the config, embedding function and retriever ahead of the first window"""
+    get_config()
+    get_embedding_function()
+    get_default_retriever()
+
+def start_background_warm_up() -> threading.Thread:
+    """Build the shared resources on a background thread, while the UI is already interactive"""
+    def warm_up():
+        try:
+            warm_up_resources()
+            print(f"Agent resources ready: {init_timings()}")
+        except Exception as e:
+            print(f"Background warm-up failed: {e}")
+    thread = threading.Thread(target=warm_up, name="ResourceWarmUp", daemon=True)
+    thread.start()
+    return thread
+
+# `config`, `ef` and `default_retriever` remain importable module attributes, built on first access
+_LAZY_ATTRIBUTES = {'config': get_config, 'ef': get_embedding_function, 'default_retriever': get_default_retriever}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def build_response_cache() -> ResponseCache:
+    """Semantic cache of agent responses, invalidated when prepare_vector_db.py re-ingests the notes"""
+    config = get_config()
+    return ResponseCache(
+        similarity=config.get('response_cache_similarity', 0.95),
+        max_size=config.get('response_cache_size', 256),
+        ttl=config.get('response_cache_ttl_seconds'),
+        path=config.get('response_cache_path'),
+        version_path=collection_version_path(config),
+    )
+
+STOCKS_INFO = {
+    "AAPL": "Buy - Strong financial performance and growth potential.",
+    "GOOGL": "Sell - Recent regulatory challenges and market competition.",
+    "MSFT": "Hold - Stable performance with moderate growth prospects.",
+    "AMZN": "Buy - Expanding market presence and innovative strategies.",
+    "TSLA": "Sell - High volatility and uncertain future outlook.",
+    "None specified": "Wait for specific stock information request."
+}
+STOCK_NAMES = {"AAPL": "Apple", "GOOGL": "Google", "MSFT": "Microsoft", "AMZN": "Amazon", "TSLA": "Tesla"}
 
 
 class Assistant(dspy.Signature):
@@ -66,18 +167,105 @@ class Assistant(dspy.Signature):
         """
     )
 
+SinglePassAssistant = Assistant.append(
+    "tool_results",
+    dspy.InputField(desc="Results of the tools, already called on the transcribed text"),
+    type_=str,
+)
+
+AGENT_MODES = ("react", "single_pass")
+BUDGET_FALLBACKS = ("single_pass", "cheaper_deployment")
 
 
 class AssistantAgent(dspy.Module):
-    def __init__(self, results_from_search: int = 3, similarity_threshold: float = 1.0):
+    """Surfaces relevant information for a window of the call.
+
+    In 'react' mode the agent picks its tools over several LM calls. In 'single_pass' mode
+    `retrieve_notes`, and `stocks_info` for every ticker mentioned, are called in parallel
+    up front and their results answered with a single LM call.
+    """
+    def __init__(self, results_from_search: int = 3, similarity_threshold: float = 1.0, retriever=None, chunk_oversample: int = 3, client_id: str | None = None, mode: str = "react"):
+        if mode not in AGENT_MODES:
+            raise ValueError(f"Unknown agent mode: {mode}")
+        self.mode = mode
         self.results_from_search = results_from_search
         self.similarity_threshold = similarity_threshold
+        self.chunk_oversample = chunk_oversample
+        self.retriever = retriever or get_default_retriever()
+        # Restricts note searches to one client's partition of the collection
+        self.where = {"client_id": client_id} if client_id else None
+        self.prefetch = SpeculativeRetriever(self.search_notes)
         self.agent = dspy.ReAct(
             signature=Assistant,
             tools=[self.retrieve_notes, self.stocks_info]
         )
+        # ReAct runs sync tools inline, which would block the event loop on note searches, so the
+        # async path gets an async retrieve_notes; it shares the predictors of the sync agent
+        self.async_agent = dspy.ReAct(
+            signature=Assistant,
+            tools=[dspy.Tool(self.aretrieve_notes, name="retrieve_notes", desc=self.retrieve_notes.__doc__), self.stocks_info]
+        )
+        self.async_agent.react = self.agent.react
+        self.async_agent.extract = self.agent.extract
+        self.single_pass = dspy.ChainOfThought(SinglePassAssistant)
+
     def forward(self, transcribed_text: str) -> str:
-        return self.agent(transcribed_text=transcribed_text)
+        if self.mode == "react":
+            return self.agent(transcribed_text=transcribed_text)
+        tool_calls = self.plan_tool_calls(transcribed_text)
+        with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+            observations = list(executor.map(lambda call: call[1](**call[2]), tool_calls))
+        tool_results, trajectory = self.format_tool_results(tool_calls, observations)
+        prediction = self.single_pass(transcribed_text=transcribed_text, tool_results=tool_results)
+        return dspy.Prediction(trajectory=trajectory, **prediction)
+
+    async def aforward(self, transcribed_text: str) -> str:
+        if self.mode == "react":
+            return await self.async_agent.acall(transcribed_text=transcribed_text)
+        tool_calls = self.plan_tool_calls(transcribed_text)
+        observations = await asyncio.gather(*(asyncio.to_thread(tool, **args) for _, tool, args in tool_calls))
+        tool_results, trajectory = self.format_tool_results(tool_calls, observations)
+        prediction = await self.single_pass.acall(transcribed_text=transcribed_text, tool_results=tool_results)
+        return dspy.Prediction(trajectory=trajectory, **prediction)
+
+    def answer_predictor(self) -> dspy.Predict:
+        """The predictor that generates the final `relevant_information` and `citations` in the current mode"""
+        return self.agent.extract.predict if self.mode == "react" else self.single_pass.predict
+
+    def plan_tool_calls(self, transcribed_text: str) -> list[tuple]:
+        """Tool calls of single-pass mode: the notes for the window, and every ticker it mentions"""
+        tool_calls = [("retrieve_notes", self.retrieve_notes, {"query": transcribed_text})]
+        for symbol in detect_tickers(transcribed_text, STOCK_NAMES):
+            tool_calls.append(("stocks_info", self.stocks_info, {"stock_symbol": symbol}))
+        return tool_calls
+
+    @staticmethod
+    def format_tool_results(tool_calls: list[tuple], observations: list) -> tuple[str, dict]:
+        """Tool results as LM input, and as a trajectory shaped like the ReAct one"""
+        sections, trajectory = [], {}
+        for i, ((name, _, args), observation) in enumerate(zip(tool_calls, observations)):
+            observation = observation or "No relevant information found."
+            sections.append(f"[{name}({json.dumps(args)})]\n{observation}")
+            trajectory[f"tool_name_{i}"] = name
+            trajectory[f"tool_args_{i}"] = args
+            trajectory[f"observation_{i}"] = observation
+        return "\n\n".join(sections), trajectory
+
+    def search_notes(self, query: str) -> list:
+        """Search the notes retriever, without the distance threshold applied.
+
+        Notes split into chunks at ingestion are collapsed to their best ranked chunk, so the
+        results hold `results_from_search` distinct notes, in the order of the retriever.
+        """
+        scope = {'where': self.where} if self.where else {}
+        with timed_stage("notes_search"):
+            search_results = self.retriever(query, k=self.results_from_search * self.chunk_oversample, **scope)
+        collapsed = {}
+        for result in search_results:
+            parent_id = (result.get('metadatas') or {}).get('parent_id') or result.get('id')
+            # The hybrid retriever's fused ranking is not ordered by score, so rank order is kept
+            collapsed.setdefault(parent_id, result)
+        return list(collapsed.values())[:self.results_from_search]
     
     def retrieve_notes(self, query: str) -> str | None:
         """Retrieve relevant notes from the previous call.
@@ -88,12 +276,17 @@ class AssistantAgent(dspy.Module):
 
         Returns:
             str: Relevant notes from the previous call with distance values."""
-        search_results = retriever(query, k=self.results_from_search)
+        search_results = self.prefetch.lookup(query)
+        if search_results is None:
+            search_results = self.search_notes(query)
         search_results = [result for result in search_results if result['score'] <= self.similarity_threshold]
         if len(search_results) == 0:
             return None
         return  "\n\n".join([f"{result['long_text']}\nDistance: {result['score']}" for result in search_results])
     
+    async def aretrieve_notes(self, query: str) -> str | None:
+        return await asyncio.to_thread(self.retrieve_notes, query)
+
     def stocks_info(self, stock_symbol: str) -> str:
         """Retrieve information about a stock.
 
@@ -102,19 +295,238 @@ class AssistantAgent(dspy.Module):
 
         Returns:
             str: Information about the stock."""
-        
-        stocks_info = {
-            "AAPL": "Buy - Strong financial performance and growth potential.",
-            "GOOGL": "Sell - Recent regulatory challenges and market competition.",
-            "MSFT": "Hold - Stable performance with moderate growth prospects.",
-            "AMZN": "Buy - Expanding market presence and innovative strategies.",
-            "TSLA": "Sell - High volatility and uncertain future outlook.",
-            "None specified": "Wait for specific stock information request."
+        return STOCKS_INFO.get(stock_symbol, "No information available for this stock.")
+
+
+class AgentRuntime:
+    """Session-scoped LM client and agent.
+
+    Built once when the analysis starts, so every transcription window only runs inference
+    and reuses the same LM client, connection pool and agent module.
+    """
+    def __init__(
+        self,
+        model_deployment_name: str,
+        temperature: float = 0.0,
+        results_from_search: int = 3,
+        similarity_threshold: float = 1.0,
+        callbacks: list[BaseCallback] | None = None,
+        client_id: str | None = None,
+        agent_mode: str = "react",
+    ):
+        self.model_deployment_name = model_deployment_name
+        self.temperature = temperature
+        self.lm = self._build_lm(model_deployment_name)
+        # LM calls, tokens and cost of every agent run; the runtime serves a single call
+        self.usage = Usage()
+        self.budget = None
+        self.budget_fallback = "single_pass"
+        self.fallback_deployment = None
+        self.over_budget = False
+        self._budget_lock = threading.Lock()
+        # Stage timings of the agent go to the latency recorder of the call being processed
+        self.callbacks = (callbacks or []) + [StageTimingCallback()]
+        self.agent = AssistantAgent(results_from_search=results_from_search, similarity_threshold=similarity_threshold, client_id=client_id, mode=agent_mode)
+        self.intent_gate = None
+        self.response_cache = None
+        self.agent_runs = 0
+        self._warm = threading.Event()
+        self._warm.set()
+
+    def _context(self):
+        # Adds to the global callbacks rather than replacing them, so MLflow autologging still traces the runs
+        return dspy.context(lm=self.lm, callbacks=[*dspy.settings.callbacks, *self.callbacks])
+
+    def _build_lm(self, deployment_name: str) -> dspy.LM:
+        pricing_model = (get_config().get('pricing_models') or {}).get(deployment_name)
+        if pricing_model:
+            pricing_models[f"azure/{deployment_name}"] = pricing_model
+        return dspy.LM(
+            model=f"azure/{deployment_name}",
+            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+            api_base=os.getenv('AZURE_OPENAI_API_BASE'),
+            api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
+            temperature=self.temperature,
+            cache=False,
+        )
+
+    def set_budget(self, budget: float, fallback: str = "single_pass", fallback_deployment: str | None = None):
+        """Downgrade the agent once the call's LM cost reaches `budget` (USD).
+
+        `fallback` is "single_pass" (one LM call per window instead of the ReAct loop) or
+        "cheaper_deployment" (switch to `fallback_deployment`).
+        """
+        if fallback not in BUDGET_FALLBACKS:
+            raise ValueError(f"Unknown budget fallback: {fallback}, expected one of {BUDGET_FALLBACKS}")
+        if fallback == "cheaper_deployment" and not fallback_deployment:
+            raise ValueError("The cheaper_deployment fallback needs a fallback deployment")
+        self.budget = budget
+        self.budget_fallback = fallback
+        self.fallback_deployment = fallback_deployment
+
+    def _check_budget(self):
+        """Apply the budget fallback the first time the call's cost reaches the budget"""
+        if self.budget is None or self.usage.cost < self.budget:
+            return
+        with self._budget_lock:
+            if self.over_budget:
+                return
+            self.over_budget = True
+        print(f"Call cost ${self.usage.cost:.4f} reached the ${self.budget:.4f} budget, falling back to {self.budget_fallback}")
+        if self.budget_fallback == "cheaper_deployment":
+            # Windows already running keep the LM they started with
+            self.model_deployment_name = self.fallback_deployment
+            self.lm = self._build_lm(self.fallback_deployment)
+        else:
+            self.agent.mode = "single_pass"
+
+    def enable_intent_gate(self, min_terms: int = 1) -> IntentGate:
+        """Skip windows without a retrievable intent before they reach the agent"""
+        self.intent_gate = IntentGate(tickers=STOCK_NAMES, min_terms=min_terms)
+        return self.intent_gate
+
+    def has_intent(self, text: str) -> bool:
+        """Whether a window should run the agent; always True without an intent gate"""
+        return self.intent_gate is None or self.intent_gate(text)
+
+    def get_usage(self) -> dict:
+        """Agent runs and the LM calls, tokens and cost they took"""
+        usage = self.usage.as_dict()
+        return {
+            'agent_runs': self.agent_runs,
+            'lm_calls': usage['lm_calls'],
+            'lm_prompt_tokens': usage['prompt_tokens'],
+            'lm_completion_tokens': usage['completion_tokens'],
+            'lm_cost': usage['cost'],
+            'lm_seconds': usage['lm_seconds'],
+            'over_budget': int(self.over_budget),
+        }
+
+    def enable_speculative_retrieval(self, debounce: float = 0.3) -> SpeculativeRetriever:
+        """Prefetch note searches from interim transcriptions and windows, for the agent to reuse"""
+        self.agent.prefetch.enabled = True
+        self.agent.prefetch.debounce = debounce
+        return self.agent.prefetch
+
+    def on_interim(self, text: str):
+        """Feed an interim transcription to speculative retrieval, when enabled"""
+        if self.agent.prefetch.enabled:
+            self.agent.prefetch.on_interim(text)
+
+    def prefetch_window(self, text: str) -> list:
+        """Search the notes for a window ahead of the agent; with speculative retrieval on, a search for the same text reuses them"""
+        if not self.agent.prefetch.enabled:
+            return self.agent.search_notes(text)
+        self.agent.prefetch.start_window()
+        return self.agent.prefetch.prefetch(text)
+
+    def retrieval_set(self, text: str, search_results: list) -> frozenset:
+        """Notes within the distance threshold and tickers mentioned: what the agent can surface for a window"""
+        notes = {
+            ('note', (result.get('metadatas') or {}).get('parent_id') or result['id'])
+            for result in search_results
+            if result['score'] <= self.agent.similarity_threshold
         }
-        return stocks_info.get(stock_symbol, "No information available for this stock.")
+        tickers = {('ticker', symbol) for symbol in detect_tickers(text, STOCK_NAMES)}
+        return frozenset(notes | tickers)
+
+    def enable_response_cache(self, response_cache: ResponseCache):
+        """Answer windows similar to an earlier one with the same retrieval set from the cache"""
+        self.response_cache = response_cache
+
+    def cached_prediction(self, text: str, retrieval_set: frozenset | None) -> dspy.Prediction | None:
+        """Cached prediction for a window, or None on a miss or without a response cache"""
+        if self.response_cache is None or retrieval_set is None:
+            return None
+        # The window was embedded by its retrieval, so this is an embedding cache hit
+        response = self.response_cache.get(retrieval_key(self.model_deployment_name, retrieval_set), get_embedding_function()([text])[0])
+        return dspy.Prediction(**response) if response is not None else None
+
+    def cache_prediction(self, text: str, retrieval_set: frozenset | None, prediction: dspy.Prediction):
+        """Store the prediction for a window in the response cache, when enabled"""
+        if self.response_cache is None or retrieval_set is None:
+            return
+        response = {key: prediction[key] for key in prediction.keys()}
+        self.response_cache.put(retrieval_key(self.model_deployment_name, retrieval_set), get_embedding_function()([text])[0], response)
+
+    def start_warm_up(self):
+        """Warm up the LM and retriever connections in the background"""
+        self._warm.clear()
+        thread = threading.Thread(target=self.warm_up, name="AgentRuntimeWarmUp", daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self):
+        """Open the LM and embedding connections so the first window is not slower than the rest"""
+        try:
+            self.lm("ping", max_tokens=1)
+            self.agent.search_notes("warm up")
+        except Exception as e:
+            print(f"Agent warm-up failed: {e}")
+        finally:
+            self._warm.set()
+
+    def __call__(self, transcribed_text: str) -> dspy.Prediction:
+        self._warm.wait()
+        self.agent_runs += 1
+        # dspy.context is thread-local, so concurrent windows can share the runtime
+        try:
+            with self._context(), metered(self.usage):
+                return self.agent(transcribed_text=transcribed_text)
+        finally:
+            self._check_budget()
+
+    async def acall(self, transcribed_text: str) -> dspy.Prediction:
+        """Run the agent on the async LM path"""
+        await asyncio.to_thread(self._warm.wait)
+        self.agent_runs += 1
+        try:
+            with self._context(), metered(self.usage):
+                return await self.agent.acall(transcribed_text=transcribed_text)
+        finally:
+            self._check_budget()
+
+    async def astream(self, transcribed_text: str, on_token) -> tuple[dspy.Prediction, float | None]:
+        """Run the agent, streaming the tokens of its final answer.
+
+        `on_token(field, text)` is called with each chunk of `relevant_information` and
+        `citations` as the LM generates them.
+
+        Returns:
+            tuple: The prediction, and the seconds until the first answer token (None if nothing was streamed).
+        """
+        await asyncio.to_thread(self._warm.wait)
+        self.agent_runs += 1
+        start = time.perf_counter()
+        time_to_first_token = None
+        prediction = None
+        try:
+            with self._context(), metered(self.usage):
+                predictor = self.agent.answer_predictor()
+                # Listeners keep per-stream state, so the streaming program is built for every window
+                stream = dspy.streamify(
+                    self.agent,
+                    stream_listeners=[
+                        dspy.streaming.StreamListener(signature_field_name="relevant_information", predict=predictor),
+                        dspy.streaming.StreamListener(signature_field_name="citations", predict=predictor),
+                    ],
+                    is_async_program=True,
+                )
+                async for chunk in stream(transcribed_text=transcribed_text):
+                    if isinstance(chunk, dspy.streaming.StreamResponse):
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - start
+                        on_token(chunk.signature_field_name, chunk.chunk)
+                    elif isinstance(chunk, dspy.Prediction):
+                        prediction = chunk
+        finally:
+            self._check_budget()
+        return prediction, time_to_first_token
 
 # for testing
 if __name__ == "__main__":
+    import mlflow
+
     class AgentLoggingCallback(BaseCallback):
         def __init__(self):
             super().__init__()
@@ -132,32 +544,25 @@ if __name__ == "__main__":
                     print(f"🔧 Using Tool: `{outputs['next_tool_name']}` with `{args_str}`")
 
 
-    # Configure LM
-    lm = dspy.LM(
-        model=f"azure/{config.get('azure_deployment_model')}",
-        api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-        api_base=os.getenv('AZURE_OPENAI_API_BASE'),
-        api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
-        cache=False
+    # Configure LM and agent once for all utterances
+    runtime = AgentRuntime(
+        model_deployment_name=get_config().get('azure_deployment_model'),
+        similarity_threshold=1.0,
+        callbacks=[AgentLoggingCallback()],
     )
-    dspy.configure(lm=lm, callbacks=[AgentLoggingCallback()])
 
     mlflow.dspy.autolog()
     mlflow.set_experiment("Agent Assistant Bank Call")
 
-    agent = AssistantAgent(similarity_threshold=1.0)
-
     utterance1 = "Bank Advisor: Good afternoon, thank you for calling ABC Bank. How can I assist you today?"
-    prediction = agent(transcribed_text=utterance1)
+    prediction = runtime(transcribed_text=utterance1)
     print(prediction)
 
     utterance2 = "Customer: Hi, I'm interested in conservative investments. Can you help?"
-    prediction = agent(transcribed_text=utterance2)
+    prediction = runtime(transcribed_text=utterance2)
     print(prediction)
 
     print(dspy.inspect_history(n=10))
-    cost = sum([token['cost'] for token in lm.history])
-    mlflow.log_metric("cost", cost)
-    print(lm.history)
-    print(lm.history.keys())
+    mlflow.log_metric("cost", runtime.usage.cost)
+    print(runtime.get_usage())
     
@@ -0,0 +1,349 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import asyncio
+import hashlib
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+import traceback
+from datetime import datetime
+import numpy as np
+
+SAMPLE_NOTES = [
+    "Client prefers conservative investments and asked about five-year fixed deposit rates.",
+    "Client holds Tesla shares and is worried about volatility; discussed diversification into bonds.",
+    "Client is refinancing a mortgage and compared fixed and variable interest rates.",
+    "Client wants to open a Roth IRA for retirement and asked about annual contribution limits.",
+    "Client asked about the fees of the conservative investment fund and the $1,000 minimum.",
+    "Client plans to buy Apple stock and asked for our analysts' current view.",
+]
+SAMPLE_UTTERANCES = [
+    "Good afternoon, thank you for calling ABC Bank. How can I assist you today?",
+    "Hi, I'm interested in conservative investments for my retirement.",
+    "Of course. Are you looking for short-term or long-term options?",
+    "Long-term, and I'd like to know the current fixed deposit rates.",
+    "Our five-year fixed deposit currently pays 3.5% per annum.",
+    "What about my Tesla shares? Should I keep them?",
+]
+
+
+class HashingEmbeddingFunction:
+    """Local bag-of-words embeddings, so retrieval and ingest run without an embedding service"""
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        embeddings = np.zeros((len(input), self.dim), dtype=np.float32)
+        for i, text in enumerate(input):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                embeddings[i, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.tolist()
+
+
+def synthetic_notes(n: int) -> list[str]:
+    return [f"{SAMPLE_NOTES[i % len(SAMPLE_NOTES)]} Follow-up #{i}." for i in range(n)]
+
+
+def timed(fn, repeat: int) -> dict:
+    """Run `fn` `repeat` times and summarize the durations"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations)
+    return {
+        'runs': repeat,
+        'mean_seconds': float(durations.mean()),
+        'min_seconds': float(durations.min()),
+        'p95_seconds': float(np.percentile(durations, 95)),
+    }
+
+
+def prepare_workspace(path: str, n_notes: int):
+    """Write a config.yaml and NumPy index in `path`, so the agent module loads without network"""
+    from numpy_retriever import write_numpy_index
+    os.makedirs(os.path.join(path, 'db'), exist_ok=True)
+    with open(os.path.join(path, 'config.yaml'), 'w') as file:
+        file.write(
+            "azure_deployment_model: benchmark\n"
+            "azure_embedding_model: benchmark\n"
+            "db_collection_name: benchmark\n"
+            "db_persist_path: db\n"
+            "retriever_backend: numpy\n"
+        )
+    notes = synthetic_notes(n_notes)
+    ids = [f"note-{i}" for i in range(n_notes)]
+    write_numpy_index(os.path.join(path, 'db', 'benchmark_numpy'), ids, notes, HashingEmbeddingFunction()(notes))
+    # Placeholders: the embedding client is built with the retriever but never called by the benchmarks
+    for name, value in [('AZURE_OPENAI_API_KEY', 'offline'), ('AZURE_OPENAI_API_BASE', 'http://localhost'), ('AZURE_OPENAI_API_VERSION', '2024-02-01')]:
+        os.environ.setdefault(name, value)
+
+
+def bench_transcription_manager(n_events: int = 20000) -> dict:
+    """Throughput of TranscriptionManager from recognizer callbacks to the asyncio consumer"""
+    from stt import TranscriptionManager
+
+    manager = TranscriptionManager()
+
+    def recognizer():
+        for i in range(n_events):
+            kind = 'final' if i % 5 == 4 else 'interim'
+            manager.publish({'text': SAMPLE_UTTERANCES[i % len(SAMPLE_UTTERANCES)], 'speaker_id': f"Guest-{i % 2}", 'type': kind})
+        manager.close()
+
+    async def consume():
+        received = 0
+        async for _ in manager.events():
+            received += 1
+        return received
+
+    async def run():
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0)
+        producer = threading.Thread(target=recognizer)
+        start = time.perf_counter()
+        producer.start()
+        received = await consumer
+        elapsed = time.perf_counter() - start
+        producer.join()
+        return received, elapsed
+
+    received, elapsed = asyncio.run(run())
+    return {
+        'events_published': n_events,
+        'events_received': received,
+        'coalesced_interims': manager.coalesced_interims,
+        'seconds': elapsed,
+        'events_per_second': n_events / elapsed,
+    }
+
+
+class StubRuntime:
+    """Agent runtime without retrieval or LM, to time the pipeline's own work"""
+    def has_intent(self, text):
+        return True
+
+    def prefetch_window(self, text):
+        return []
+
+    def retrieval_set(self, text, search_results):
+        return frozenset()
+
+    def cached_prediction(self, text, retrieval_set):
+        return None
+
+    def cache_prediction(self, text, retrieval_set, prediction):
+        pass
+
+    async def acall(self, text):
+        return StubPrediction()
+
+
+class StubPrediction:
+    relevant_information = "Waiting for more information"
+    citations = "None"
+
+
+def bench_windowing(n_utterances: int = 5000, buffer_size: int = 4, buffer_overlap: int = 2) -> dict:
+    """Utterances through the call pipeline's windowing, retrieval and reasoning stages"""
+    from pipeline import CallPipeline
+
+    async def events():
+        for i in range(n_utterances):
+            yield {'text': SAMPLE_UTTERANCES[i % len(SAMPLE_UTTERANCES)], 'speaker_id': f"Guest-{i % 2}", 'type': 'final'}
+
+    results = []
+    pipeline = CallPipeline(
+        StubRuntime(), on_transcription=lambda t: None, on_result=results.append,
+        buffer_size=buffer_size, buffer_overlap=buffer_overlap, deduplicate=False,
+    )
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            asyncio.run(pipeline.run(events()))
+        finally:
+            sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    return {
+        'utterances': n_utterances,
+        'windows': pipeline.windows,
+        'results': len(results),
+        'seconds': elapsed,
+        'utterances_per_second': n_utterances / elapsed,
+    }
+
+
+def bench_retrieve_notes(workspace: str, corpus_sizes: tuple = (100, 1000, 10000), repeat: int = 200) -> dict:
+    """`AssistantAgent.retrieve_notes` over the NumPy backend, with threshold filtering"""
+    from numpy_retriever import write_numpy_index, NumpyRM
+    from bank_call_agent import AssistantAgent
+
+    ef = HashingEmbeddingFunction()
+    results = {}
+    for n in corpus_sizes:
+        index_path = os.path.join(workspace, f"retrieve_{n}")
+        notes = synthetic_notes(n)
+        write_numpy_index(index_path, [f"note-{i}" for i in range(n)], notes, ef(notes))
+        agent = AssistantAgent(results_from_search=3, similarity_threshold=0.8, retriever=NumpyRM(index_path, ef))
+        queries = [f"{SAMPLE_UTTERANCES[i % len(SAMPLE_UTTERANCES)]} {i}" for i in range(repeat)]
+        queries_iter = iter(queries)
+        results[f"notes_{n}"] = timed(lambda: agent.search_notes(next(queries_iter)), repeat)
+        # Threshold filtering and formatting on top of the search
+        results[f"notes_{n}_retrieve_notes"] = timed(lambda: agent.retrieve_notes("conservative fixed deposit rates"), repeat)
+    return results
+
+
+def bench_agent_single_pass(repeat: int = 50) -> dict:
+    """One single-pass agent run with a stub LM: tool calls, prompt formatting and parsing"""
+    import dspy
+    from dspy.utils.dummies import DummyLM
+    from numpy_retriever import NumpyRM, default_index_path
+    from bank_call_agent import AssistantAgent, config
+
+    agent = AssistantAgent(retriever=NumpyRM(default_index_path(config), HashingEmbeddingFunction()), mode="single_pass")
+    answer = {'reasoning': "The client asks about fixed deposits.", 'citations': "1. Fixed deposit note", 'relevant_information': "Fixed deposit rates [1]"}
+    lm = DummyLM([answer] * repeat)
+    with dspy.context(lm=lm):
+        return timed(lambda: agent(transcribed_text="\n".join(SAMPLE_UTTERANCES)), repeat)
+
+
+def bench_render_results(list_sizes: tuple = (10, 50, 200), repeat: int = 20) -> dict:
+    """Cost of adding one published result to a results feed already holding n results"""
+    import dspy
+    import streamlit as st
+    from results_view import ResultsFeed
+
+    def result(i):
+        return {
+            'prediction': dspy.Prediction(
+                relevant_information=f"Fixed deposit rates [1] ({i})",
+                citations="1. Fixed deposit note",
+                reasoning="The client asks about fixed deposits.",
+                trajectory={'tool_name_0': 'retrieve_notes', 'tool_args_0': {'query': 'fixed deposit'}, 'observation_0': SAMPLE_NOTES[0]},
+            ),
+            'input_text': "\n".join(SAMPLE_UTTERANCES[:4]),
+            'timestamp': datetime.fromtimestamp(i),
+        }
+
+    results = {}
+    for n in list_sizes:
+        feed = ResultsFeed()
+        feed.mount(st.empty())
+        for i in range(n):
+            feed.add(result(i))
+        # Newer results, as published during a call; every page_size-th one collapses the page
+        added = iter(range(n, n + repeat + 1))
+        feed.add(result(next(added)))  # warm-up
+        results[f"results_{n}"] = timed(lambda: feed.add(result(next(added))), repeat)
+    return results
+
+
+def bench_ingest(n_notes: int = 2000, batch_size: int = 64, concurrency: int = 4) -> dict:
+    """`prepare_vector_db.ingest_notes_file` into an in-memory Chroma collection, then a no-op re-run"""
+    import chromadb
+    from prepare_vector_db import ingest_notes_file
+
+    ef = HashingEmbeddingFunction()
+    with tempfile.TemporaryDirectory() as folder:
+        notes_file = os.path.join(folder, 'call_notes.txt')
+        with open(notes_file, 'w') as file:
+            file.write("\n".join(synthetic_notes(n_notes)))
+        collection = chromadb.EphemeralClient().get_or_create_collection(
+            f"benchmark_{os.getpid()}_{time.time_ns()}", metadata={"hnsw:space": "cosine"}
+        )
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                start = time.perf_counter()
+                ingest_notes_file(collection, ef, notes_file, batch_size=batch_size, concurrency=concurrency)
+                elapsed = time.perf_counter() - start
+                start = time.perf_counter()
+                ingest_notes_file(collection, ef, notes_file, batch_size=batch_size, concurrency=concurrency)
+                rerun_elapsed = time.perf_counter() - start
+            finally:
+                sys.stdout = stdout
+    return {
+        'notes': n_notes,
+        'seconds': elapsed,
+        'notes_per_second': n_notes / elapsed,
+        'unchanged_rerun_seconds': rerun_elapsed,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline micro-benchmarks of the assistant hot paths (no network needed)')
+    parser.add_argument('--output', type=str, default='benchmark_results.json',
+                      help='JSON file to write the results to')
+    parser.add_argument('--only', type=str, nargs='+',
+                      help='Run only these benchmarks')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Rendering outside `streamlit run` warns about the missing script context on every element.
+    # Streamlit resets its logger levels when it parses its config, so the logger is disabled instead
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').disabled = True
+    output = os.path.abspath(args.output)
+    workspace = tempfile.mkdtemp(prefix='benchmark_')
+    cwd = os.getcwd()
+    try:
+        prepare_workspace(workspace, n_notes=500)
+        # The agent module reads config.yaml from the working directory
+        os.chdir(workspace)
+
+        benchmarks = {
+            'transcription_manager': bench_transcription_manager,
+            'windowing': bench_windowing,
+            'retrieve_notes': lambda: bench_retrieve_notes(workspace),
+            'agent_single_pass': bench_agent_single_pass,
+            'render_results': bench_render_results,
+            'ingest': bench_ingest,
+        }
+        results = {}
+        for name, benchmark in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"Running {name}...")
+            try:
+                results[name] = benchmark()
+            except Exception as e:
+                traceback.print_exc()
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+            print(f"{name}: {json.dumps(results[name])}")
+    finally:
+        # Leave no Chroma store, NumPy index or caches behind in the temp folder
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote benchmark results to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from text_terms import tokenize
+
+NO_INFORMATION = "Waiting for more information"
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the content words of two texts"""
+    a_terms, b_terms = set(tokenize(a)), set(tokenize(b))
+    if not a_terms or not b_terms:
+        return 0.0
+    return len(a_terms & b_terms) / len(a_terms | b_terms)
+
+
+class CallMemory:
+    """What a call has already surfaced, to avoid repeating it.
+
+    Overlapping windows often retrieve the same notes. A window whose retrieval set (the ids
+    of the notes within the distance threshold, and the tickers mentioned) is unchanged from
+    the previous window, or holds only notes and tickers already surfaced, is redundant and
+    does not need the LM. Results close to one already published are near-duplicates.
+    """
+    def __init__(self, duplicate_similarity: float = 0.8):
+        self.duplicate_similarity = duplicate_similarity
+        self.surfaced = set()
+        self.published = []
+        self.redundant_windows = 0
+        self.duplicate_results = 0
+        self._last_retrieval_set = None
+
+    def is_redundant(self, retrieval_set: frozenset) -> bool:
+        """Whether a window would only surface what the call already has"""
+        redundant = retrieval_set == self._last_retrieval_set or (bool(retrieval_set) and retrieval_set <= self.surfaced)
+        self._last_retrieval_set = retrieval_set
+        if redundant:
+            self.redundant_windows += 1
+        return redundant
+
+    def is_duplicate(self, prediction) -> bool:
+        """Whether a prediction repeats a result already published"""
+        for published in self.published:
+            same_citations = prediction.citations not in ("", "None") and prediction.citations == published.citations
+            if same_citations or text_similarity(
+                prediction.relevant_information, published.relevant_information
+            ) >= self.duplicate_similarity:
+                self.duplicate_results += 1
+                return True
+        return False
+
+    def remember(self, retrieval_set: frozenset, prediction):
+        """Record a published result and the notes and tickers it surfaced"""
+        if prediction.relevant_information == NO_INFORMATION:
+            return
+        self.surfaced |= retrieval_set
+        self.published.append(prediction)
+
+    def get_stats(self) -> dict:
+        return {
+            'redundant_lm_calls_avoided': self.redundant_windows,
+            'duplicate_results_suppressed': self.duplicate_results,
+        }
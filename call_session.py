@@ -0,0 +1,213 @@
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+from stt import PcmAudioSource, TranscriptReplaySource, TranscriptionManager, audio_source, start_replay_transcription, start_stream_transcription
+from pipeline import CallPipeline
+from metrics import start_metrics_server
+
+
+class CallRegistry:
+    """Process-wide bookkeeping of the call sessions, to measure how many calls a process can carry"""
+    def __init__(self):
+        self.active = set()
+        self.peak_active = 0
+        self.finished = 0
+        self.audio_seconds = 0.0
+        self._cpu_start = time.process_time()
+        self._lock = threading.Lock()
+
+    def register(self, session):
+        with self._lock:
+            self.active.add(session.call_id)
+            self.peak_active = max(self.peak_active, len(self.active))
+
+    def unregister(self, session):
+        with self._lock:
+            self.active.discard(session.call_id)
+            self.finished += 1
+            self.audio_seconds += session.audio_seconds
+
+    def get_capacity(self) -> dict:
+        """Capacity report of the process.
+
+        `realtime_call_capacity` is the seconds of call audio handled per second of process CPU
+        time: roughly how many real-time calls the process could carry before its own work,
+        not the remote services, becomes the bottleneck.
+        """
+        with self._lock:
+            cpu_seconds = time.process_time() - self._cpu_start
+            return {
+                'active_calls': len(self.active),
+                'peak_concurrent_calls': self.peak_active,
+                'finished_calls': self.finished,
+                'audio_seconds': self.audio_seconds,
+                'process_cpu_seconds': cpu_seconds,
+                'realtime_call_capacity': self.audio_seconds / cpu_seconds if cpu_seconds else 0.0,
+            }
+
+
+call_registry = CallRegistry()
+
+
+class CallSession:
+    """One call: its transcriber, transcription queue, windowing state, agent runtime and results.
+
+    Nothing is shared between sessions except the process-wide retriever and caches, so one
+    process can run several calls concurrently.
+    """
+    def __init__(self, runtime, on_transcription=None, on_result=None, call_id: str | None = None, min_interim_interval: float = 0.0, **pipeline_options):
+        self.call_id = call_id or uuid.uuid4().hex[:8]
+        self.runtime = runtime
+        self.transcription_manager = TranscriptionManager(min_interim_interval=min_interim_interval)
+        self.results = []
+        self.audio_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._on_transcription = on_transcription
+        self._on_result = on_result
+        self.pipeline = CallPipeline(
+            runtime,
+            on_transcription=self._handle_transcription,
+            on_result=self._handle_result,
+            call_id=self.call_id,
+            **pipeline_options,
+        )
+
+    def _handle_transcription(self, transcription):
+        if transcription['type'] == 'final':
+            self.audio_seconds = max(self.audio_seconds, transcription.get('audio_end', 0.0))
+        if self._on_transcription:
+            self._on_transcription(transcription)
+
+    def _handle_result(self, result):
+        self.results.append(result)
+        if self._on_result:
+            self._on_result(result)
+
+    async def run(self, source: PcmAudioSource | TranscriptReplaySource, realtime: bool = False):
+        """Transcribe and analyze a call until its transcription session stops.
+
+        A `TranscriptReplaySource` replays a transcript instead, without the speech service.
+        """
+        call_registry.register(self)
+        start = time.perf_counter()
+        if isinstance(source, TranscriptReplaySource):
+            conversation_transcriber = start_replay_transcription(source, self.transcription_manager)
+        else:
+            conversation_transcriber = start_stream_transcription(source, self.transcription_manager, realtime=realtime)
+        try:
+            await self.pipeline.run(self.transcription_manager.events())
+        finally:
+            conversation_transcriber.stop_transcribing_async()
+            self.wall_seconds = time.perf_counter() - start
+            call_registry.unregister(self)
+
+    def get_gate_stats(self) -> dict:
+        """Intent gate skip rate, and the LM calls and cost saved, estimated from the agent's average run"""
+        usage = self.runtime.get_usage()
+        runs = usage['agent_runs']
+        skipped = self.pipeline.windows_skipped
+        return {
+            'gate_windows': self.pipeline.windows,
+            'gate_windows_skipped': skipped,
+            'gate_skip_rate': skipped / self.pipeline.windows if self.pipeline.windows else 0.0,
+            'gate_lm_calls_saved': skipped * usage['lm_calls'] / runs if runs else 0.0,
+            'gate_cost_saved': skipped * usage['lm_cost'] / runs if runs else 0.0,
+        }
+
+    def get_agent_stats(self) -> dict:
+        """Agent latency, LM usage of the call, and LM calls and cost per run, to compare agent modes"""
+        usage = self.runtime.get_usage()
+        runs = usage['agent_runs']
+        latencies = self.pipeline.agent_latencies
+        times_to_first_token = self.pipeline.times_to_first_token
+        return {
+            'agent_latency_mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'agent_latency_max': max(latencies, default=0.0),
+            'time_to_first_token_mean': sum(times_to_first_token) / len(times_to_first_token) if times_to_first_token else 0.0,
+            'time_to_first_token_max': max(times_to_first_token, default=0.0),
+            'lm_calls_per_run': usage['lm_calls'] / runs if runs else 0.0,
+            'lm_cost_per_run': usage['lm_cost'] / runs if runs else 0.0,
+            'lm_calls': usage['lm_calls'],
+            'lm_prompt_tokens': usage['lm_prompt_tokens'],
+            'lm_completion_tokens': usage['lm_completion_tokens'],
+            'lm_cost': usage['lm_cost'],
+            'lm_seconds': usage['lm_seconds'],
+            'over_budget': usage['over_budget'],
+        }
+
+    def get_stats(self) -> dict:
+        """Per-call statistics"""
+        return {
+            'audio_seconds': self.audio_seconds,
+            'wall_seconds': self.wall_seconds,
+            'results': len(self.results),
+            'coalesced_interims': self.transcription_manager.coalesced_interims,
+            **self.pipeline.scheduler.get_stats(),
+            **self.get_gate_stats(),
+            **self.get_agent_stats(),
+            **self.pipeline.memory.get_stats(),
+            **self.pipeline.latency.summary(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several calls concurrently in one process and report its call capacity')
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--audio-file', type=str,
+                      help='Path to the call recording to analyze')
+    input_group.add_argument('--transcript-file', type=str,
+                      help='Replay a call_transcriptions.jsonl file instead of transcribing audio')
+    parser.add_argument('--words-per-second', type=float, default=2.5,
+                      help='Speaking rate of the replayed transcript')
+    parser.add_argument('--interim-words', type=int, default=3,
+                      help='Words between the interim transcriptions of the replay')
+    parser.add_argument('--jitter', type=float, default=0.2,
+                      help='Random variation of the replay timing, as a fraction of each step')
+    parser.add_argument('--speed', type=float, default=1.0,
+                      help='Replay speed: 1 is real time, 0 replays without waiting')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Seed of the replay timing jitter')
+    parser.add_argument('--calls', type=int, default=2,
+                      help='Number of concurrent calls')
+    parser.add_argument('--metrics-port', type=int,
+                      help='Serve the per-call latency metrics on this local port')
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    from bank_call_agent import AgentRuntime, config
+
+    if args.audio_file:
+        with open(args.audio_file, 'rb') as file:
+            data = file.read()
+
+    def source():
+        if args.transcript_file:
+            return TranscriptReplaySource.from_jsonl(
+                args.transcript_file,
+                words_per_second=args.words_per_second,
+                interim_words=args.interim_words,
+                jitter=args.jitter,
+                speed=args.speed,
+                seed=args.seed,
+            )
+        return audio_source(data, args.audio_file)
+
+    def run_call(i):
+        runtime = AgentRuntime(model_deployment_name=config.get('azure_deployment_model'))
+        session = CallSession(runtime, call_id=f"call-{i}")
+        asyncio.run(session.run(source()))
+        print(f"{session.call_id}: {session.get_stats()}")
+
+    threads = [threading.Thread(target=run_call, args=(i,)) for i in range(args.calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"process capacity: {call_registry.get_capacity()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import re
+import time
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from metrics import timed_stage
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry"""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" .,;:!?\"'")
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """LRU cache in front of an embedding function.
+
+    Entries are keyed by normalized text and expire after `ttl` seconds. An optional SQLite
+    file keeps embeddings across restarts, so a warm process does not pay the embedding
+    round-trip for queries it has already seen.
+    """
+    def __init__(
+        self,
+        embedding_function: EmbeddingFunction,
+        max_size: int = 1024,
+        ttl: float | None = None,
+        path: str | None = None,
+        disk_max_size: int = 100_000,
+        namespace: str = "",
+    ):
+        self.embedding_function = embedding_function
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_max_size = disk_max_size
+        self.namespace = namespace
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()  # key -> (created, embedding)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB, created REAL)"
+            )
+            self._db.commit()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [f"{self.namespace}:{normalize_query(text)}" for text in input]
+        embeddings = [None] * len(input)
+        missing = {}  # key -> indices of the inputs waiting for it
+        with self._lock:
+            for i, key in enumerate(keys):
+                embedding = self._get(key)
+                if embedding is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    embeddings[i] = embedding
+
+        if missing:
+            texts = [input[indices[0]] for indices in missing.values()]
+            with timed_stage("embedding_request"):
+                computed = self.embedding_function(texts)
+            with self._lock:
+                for (key, indices), embedding in zip(missing.items(), computed):
+                    self._put(key, embedding)
+                    for i in indices:
+                        embeddings[i] = embedding
+        return embeddings
+
+    def _get(self, key: str):
+        now = time.time()
+        entry = self._cache.get(key)
+        if entry is not None:
+            created, embedding = entry
+            if self.ttl is None or now - created < self.ttl:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return embedding
+            del self._cache[key]
+
+        if self._db is not None:
+            row = self._db.execute("SELECT embedding, created FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                blob, created = row
+                if self.ttl is None or now - created < self.ttl:
+                    embedding = array('f', blob).tolist()
+                    self._remember(key, created, embedding)
+                    self.disk_hits += 1
+                    return embedding
+                self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._db.commit()
+
+        self.misses += 1
+        return None
+
+    def _put(self, key: str, embedding):
+        created = time.time()
+        self._remember(key, created, embedding)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, created) VALUES (?, ?, ?)",
+                (key, array('f', embedding).tobytes(), created),
+            )
+            # Keep the on-disk tier bounded by dropping the oldest entries
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.disk_max_size,),
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, created: float, embedding):
+        self._cache[key] = (created, embedding)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters of the cache"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'embedding_cache_hits': self.hits,
+            'embedding_cache_disk_hits': self.disk_hits,
+            'embedding_cache_misses': self.misses,
+            'embedding_cache_evictions': self.evictions,
+            'embedding_cache_hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,42 @@
+import re
+from text_terms import tokenize
+
+# Banking and investment vocabulary, in the form `tokenize` produces
+FINANCE_TERMS = {
+    "401k", "account", "aggressive", "allocation", "annuity", "balance", "bond", "broker", "budget",
+    "cd", "certificate", "checking", "conservative", "credit", "crypto", "debt", "deposit", "diversification",
+    "diversify", "dividend", "equity", "etf", "fee", "fund", "growth", "income", "inflation", "insurance",
+    "interest", "invest", "investing", "investment", "ira", "loan", "market", "mortgage", "pension",
+    "portfolio", "rate", "refinance", "refinancing", "retirement", "return", "risk", "roth", "saving",
+    "share", "stock", "tax", "transfer", "treasury", "volatility", "wealth", "yield",
+}
+
+
+def detect_tickers(text: str, tickers: dict[str, str]) -> list[str]:
+    """Ticker symbols mentioned in a text, by symbol ("TSLA") or company name ("Tesla")
+
+    Args:
+        text (str): The text to search.
+        tickers (dict[str, str]): Ticker symbol -> company name.
+    """
+    words = set(re.findall(r"[A-Za-z]+", text))
+    lower_words = {word.lower() for word in words}
+    return [symbol for symbol, name in tickers.items() if symbol in words or name.lower() in lower_words]
+
+
+class IntentGate:
+    """Local check that a window holds a retrievable intent, run before the agent.
+
+    A window passes when it mentions a known ticker or at least `min_terms` banking or
+    investment terms. Greetings and small talk, which the agent would answer with
+    "Waiting for more information" after several LM calls, are skipped without any.
+    """
+    def __init__(self, tickers: dict[str, str] | None = None, vocabulary: set[str] | None = None, min_terms: int = 1):
+        self.tickers = tickers or {}
+        self.vocabulary = vocabulary or FINANCE_TERMS
+        self.min_terms = min_terms
+
+    def __call__(self, text: str) -> bool:
+        if detect_tickers(text, self.tickers):
+            return True
+        return len(self.vocabulary.intersection(tokenize(text))) >= self.min_terms
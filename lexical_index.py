@@ -0,0 +1,175 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import Counter
+from dspy.dsp.utils import dotdict
+from text_terms import tokenize
+from numpy_retriever import PartitionCache, where_matches
+
+
+def default_lexical_index_path(config: dict) -> str:
+    """BM25 index file, persisted next to the Chroma store"""
+    return os.path.join(config.get('db_persist_path'), f"{config.get('db_collection_name')}_bm25.json")
+
+
+class BM25Index:
+    """In-process BM25 inverted index over the notes.
+
+    Besides the BM25 ranking, each search reports its confidence: the IDF-weighted share of
+    the query terms found in the best note. Exact terms such as product names or tickers give
+    a high confidence, vague queries a low one.
+    """
+    def __init__(self, ids: list[str], documents: list[str], metadatas: list[dict] | None = None, k1: float = 1.5, b: float = 0.75, max_partitions: int = 256):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas or [None] * len(ids)
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> [(document index, term frequency)]
+        self.doc_lengths = []
+        for i, document in enumerate(documents):
+            terms = tokenize(document)
+            self.doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((i, frequency))
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        n = len(documents)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        self._partitions = PartitionCache(max_partitions)  # where filter -> BM25Index over the matching notes
+
+    def partition(self, where: dict | None) -> "BM25Index":
+        """Index over the notes matching a `where` filter, cached for the most recently used filters"""
+        if not where:
+            return self
+
+        def build():
+            rows = [i for i, metadata in enumerate(self.metadatas) if where_matches(metadata, where)]
+            return BM25Index(
+                [self.ids[i] for i in rows],
+                [self.documents[i] for i in rows],
+                [self.metadatas[i] for i in rows],
+                k1=self.k1,
+                b=self.b,
+            )
+        return self._partitions.get(where, build)
+
+    def search(self, query: str, k: int = 3) -> tuple[list[tuple[int, float]], float]:
+        """Rank the notes for a query.
+
+        Returns:
+            tuple: The top-k (document index, BM25 score) pairs, and the confidence of the top one.
+        """
+        terms = set(tokenize(query))
+        scores = Counter()
+        for term in terms:
+            idf = self.idf.get(term, 0.0)
+            for i, frequency in self.postings.get(term, []):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_doc_length)
+                scores[i] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        top = scores.most_common(k)
+        if not top:
+            return [], 0.0
+        return top, self.coverage(query, top[0][0])
+
+    def coverage(self, query: str, i: int) -> float:
+        """IDF-weighted share of the query terms found in note `i`"""
+        terms = set(tokenize(query))
+        # Unknown terms get the IDF of a term found in a single note
+        max_idf = math.log(1 + (len(self.ids) - 0.5) / 1.5)
+        query_weight = sum(self.idf.get(term, max_idf) for term in terms)
+        found = set(tokenize(self.documents[i])) & terms
+        return sum(self.idf[term] for term in found) / query_weight if query_weight else 0.0
+
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            json.dump({'ids': self.ids, 'documents': self.documents, 'metadatas': self.metadatas}, file)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r') as file:
+            data = json.load(file)
+        return cls(data['ids'], data['documents'], data['metadatas'])
+
+
+class HybridRM:
+    """Fuses BM25 and vector rankings, with a lexical-only fast path.
+
+    When the BM25 confidence reaches `fast_path_confidence`, the lexical results are returned
+    without embedding the query. Otherwise both rankings are merged with reciprocal rank
+    fusion. Results keep the `ChromadbRM` shape; lexical-only results get one minus their own
+    query-term coverage as their distance score. That score is not a cosine distance, so the
+    agent's distance threshold does not calibrate it: lexical-only results covering less than
+    `min_lexical_coverage` of the query are dropped instead. A `where` filter scopes both
+    searches to a partition of the notes.
+    """
+    def __init__(self, vector_rm, lexical_index: BM25Index, fast_path_confidence: float = 0.8, min_lexical_coverage: float = 0.5, rrf_k: int = 60):
+        self.vector_rm = vector_rm
+        self.lexical_index = lexical_index
+        self.fast_path_confidence = fast_path_confidence
+        self.min_lexical_coverage = min_lexical_coverage
+        self.rrf_k = rrf_k
+        self.lookups = 0
+        self.fast_path_hits = 0
+        self.latency_saved = 0.0
+        self._vector_latency = None  # moving average of the vector search latency
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _lexical_result(index: BM25Index, i: int, coverage: float) -> dotdict:
+        return dotdict({
+            'id': index.ids[i],
+            'score': 1.0 - coverage,
+            'long_text': index.documents[i],
+            'metadatas': index.metadatas[i],
+        })
+
+    def __call__(self, query: str, k: int = 3, where: dict | None = None, **kwargs) -> list[dotdict]:
+        start = time.perf_counter()
+        index = self.lexical_index.partition(where)
+        lexical, confidence = index.search(query, k=k)
+        if lexical and confidence >= self.fast_path_confidence:
+            lexical_latency = time.perf_counter() - start
+            with self._lock:
+                self.lookups += 1
+                self.fast_path_hits += 1
+                if self._vector_latency is not None:
+                    self.latency_saved += max(0.0, self._vector_latency - lexical_latency)
+            coverages = [(i, index.coverage(query, i)) for i, _ in lexical]
+            return [self._lexical_result(index, i, coverage) for i, coverage in coverages if coverage >= self.min_lexical_coverage]
+
+        vector_start = time.perf_counter()
+        if where:
+            kwargs['where'] = where
+        vector = self.vector_rm(query, k=k, **kwargs)
+        vector_latency = time.perf_counter() - vector_start
+        with self._lock:
+            self.lookups += 1
+            self._vector_latency = vector_latency if self._vector_latency is None else 0.8 * self._vector_latency + 0.2 * vector_latency
+
+        fused, results = Counter(), {}
+        for rank, result in enumerate(vector):
+            fused[result['id']] += 1 / (self.rrf_k + rank + 1)
+            results[result['id']] = result
+        for rank, (i, _) in enumerate(lexical):
+            id = index.ids[i]
+            if id not in results:
+                coverage = index.coverage(query, i)
+                if coverage < self.min_lexical_coverage:
+                    continue
+                results[id] = self._lexical_result(index, i, coverage)
+            fused[id] += 1 / (self.rrf_k + rank + 1)
+        return [results[id] for id, _ in fused.most_common(k)]
+
+    def get_stats(self) -> dict:
+        """Lexical fast path hit rate and latency saved"""
+        return {
+            'lexical_lookups': self.lookups,
+            'lexical_fast_path_hits': self.fast_path_hits,
+            'lexical_fast_path_hit_rate': self.fast_path_hits / self.lookups if self.lookups else 0.0,
+            'lexical_latency_saved_seconds': self.latency_saved,
+        }
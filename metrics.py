@@ -0,0 +1,162 @@
+import time
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from dspy.utils.callback import BaseCallback
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyRecorder:
+    """Durations of the stages of one call, summarized as percentiles"""
+    def __init__(self):
+        self._durations = {}  # stage -> seconds
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """p50/p95/p99, mean and count of every stage, as flat metric names"""
+        with self._lock:
+            durations = {stage: np.array(values) for stage, values in self._durations.items()}
+        metrics = {}
+        for stage, values in sorted(durations.items()):
+            for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                metrics[f"latency_{stage}_p{percentile}"] = float(value)
+            metrics[f"latency_{stage}_mean"] = float(values.mean())
+            metrics[f"latency_{stage}_count"] = len(values)
+        return metrics
+
+
+# The recorder of the call being processed; asyncio tasks and `asyncio.to_thread` inherit it
+current_recorder = contextvars.ContextVar("current_recorder", default=None)
+
+
+def record_latency(stage: str, seconds: float):
+    """Record a stage duration for the current call, if there is one"""
+    recorder = current_recorder.get()
+    if recorder is not None:
+        recorder.record(stage, seconds)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time a block as a stage of the current call"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_latency(stage, time.perf_counter() - start)
+
+
+class StageTimingCallback(BaseCallback):
+    """Records every ReAct step, LM call and tool call of the agent as stages of the current call"""
+    def __init__(self):
+        super().__init__()
+        self._starts = {}  # dspy call id -> (stage, start)
+        self._lock = threading.Lock()
+
+    def _start(self, call_id, stage):
+        if stage is not None and current_recorder.get() is not None:
+            with self._lock:
+                self._starts[call_id] = (stage, time.perf_counter())
+
+    def _end(self, call_id):
+        with self._lock:
+            started = self._starts.pop(call_id, None)
+        if started is not None:
+            stage, start = started
+            record_latency(stage, time.perf_counter() - start)
+
+    def on_module_start(self, call_id, instance, inputs):
+        signature = getattr(instance, 'signature', None)
+        # The predictor that picks the next thought and tool is one ReAct step
+        is_react_step = signature is not None and 'next_tool_name' in signature.output_fields
+        self._start(call_id, "react_step" if is_react_step else None)
+
+    def on_module_end(self, call_id, outputs, exception):
+        self._end(call_id)
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self._start(call_id, "lm_call")
+
+    def on_lm_end(self, call_id, outputs, exception):
+        self._end(call_id)
+
+    def on_tool_start(self, call_id, instance, inputs):
+        self._start(call_id, f"tool_{instance.name}")
+
+    def on_tool_end(self, call_id, outputs, exception):
+        self._end(call_id)
+
+
+class MetricsRegistry:
+    """Latency recorders of the most recent calls of the process, for the metrics endpoint"""
+    def __init__(self, max_calls: int = 20):
+        self.max_calls = max_calls
+        self._recorders = OrderedDict()  # call id -> LatencyRecorder
+        self._lock = threading.Lock()
+
+    def register(self, call_id: str, recorder: LatencyRecorder):
+        with self._lock:
+            self._recorders[call_id] = recorder
+            while len(self._recorders) > self.max_calls:
+                self._recorders.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        """Latency summary of every registered call"""
+        with self._lock:
+            recorders = list(self._recorders.items())
+        return {call_id: recorder.summary() for call_id, recorder in recorders}
+
+    def prometheus(self) -> str:
+        """The snapshot in the Prometheus text format"""
+        lines = []
+        for call_id, metrics in self.snapshot().items():
+            for name, value in metrics.items():
+                lines.append(f'call_assistant_{name}{{call_id="{call_id}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = metrics_registry.prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(metrics_registry.snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the per-call latency metrics on http://host:port/metrics (and /metrics.json)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True)
+    thread.start()
+    print(f"Serving latency metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,183 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from dspy.dsp.utils import dotdict
+
+EMBEDDINGS_FILE = "embeddings.npy"
+NOTES_FILE = "notes.jsonl"
+
+
+def default_index_path(config: dict) -> str:
+    """Folder of the NumPy index, next to the Chroma store unless configured otherwise"""
+    return config.get('numpy_index_path') or os.path.join(
+        config.get('db_persist_path'), f"{config.get('db_collection_name')}_numpy"
+    )
+
+
+def where_matches(metadata: dict | None, where: dict) -> bool:
+    """Evaluate a Chroma-style `where` filter (equality, `$eq` and `$and`) against note metadata"""
+    metadata = metadata or {}
+    for key, value in where.items():
+        if key == "$and":
+            if not all(where_matches(metadata, clause) for clause in value):
+                return False
+        elif isinstance(value, dict):
+            if metadata.get(key) != value.get("$eq"):
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class PartitionCache:
+    """LRU cache of per-`where` partitions, so one per client does not grow without bound"""
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # where filter -> partition
+        self._lock = threading.Lock()
+
+    def get(self, where: dict, build):
+        """The partition of a filter, built with `build()` on a miss"""
+        key = json.dumps(where, sort_keys=True)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        partition = build()
+        with self._lock:
+            self._entries[key] = partition
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return partition
+
+
+def write_numpy_index(index_path: str, ids: list[str], documents: list[str], embeddings, metadatas: list[dict] | None = None):
+    """Write note embeddings as a contiguous, row-normalized float32 matrix plus the note texts.
+
+    Both files are written under temporary names and moved into place, the embeddings last, so
+    a running app that memory-maps the old embeddings keeps reading a complete file and
+    reloads once the new embeddings appear.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+    if len(matrix):
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    embeddings_path = os.path.join(index_path, EMBEDDINGS_FILE)
+    notes_path = os.path.join(index_path, NOTES_FILE)
+    # np.save would append .npy to a temporary name, so it is given an open file
+    with open(f"{embeddings_path}.tmp", 'wb') as file:
+        np.save(file, matrix)
+    metadatas = metadatas or [None] * len(ids)
+    with open(f"{notes_path}.tmp", 'w') as file:
+        for id, document, metadata in zip(ids, documents, metadatas):
+            file.write(json.dumps({'id': id, 'document': document, 'metadata': metadata}) + '\n')
+    os.replace(f"{notes_path}.tmp", notes_path)
+    os.replace(f"{embeddings_path}.tmp", embeddings_path)
+
+
+def index_version(embeddings_path: str) -> tuple:
+    """Identity of the embeddings file, which changes whenever the index is rewritten"""
+    stat = os.stat(embeddings_path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class LoadedIndex:
+    """One version of the NumPy index on disk: its memory-mapped embeddings, notes and partitions"""
+    def __init__(self, index_path: str, max_partitions: int = 256):
+        embeddings_path = os.path.join(index_path, EMBEDDINGS_FILE)
+        self.version = index_version(embeddings_path)
+        self.embeddings = np.load(embeddings_path, mmap_mode='r')
+        with open(os.path.join(index_path, NOTES_FILE), 'r') as file:
+            self.notes = [json.loads(line) for line in file]
+        if len(self.notes) != len(self.embeddings):
+            raise ValueError(f"NumPy index at {index_path} has {len(self.embeddings)} embeddings for {len(self.notes)} notes")
+        self.partitions = PartitionCache(max_partitions)  # where filter -> row indices
+
+
+class NumpyRM:
+    """Brute-force cosine retriever for small note corpora.
+
+    The note embeddings are memory-mapped from the file written by `prepare_vector_db.py`,
+    so a search is a single matrix-vector product with no database round-trip. Results use
+    the same shape and cosine distance scores as `ChromadbRM`. A `where` filter restricts the
+    search to the rows of a partition, e.g. one client's notes, which are looked up once and
+    cached, so a scoped search only scores that partition. When `prepare_vector_db.py`
+    rewrites the index, the next search reloads it.
+    """
+    def __init__(self, index_path: str, embedding_function, k: int = 3, max_partitions: int = 256):
+        self.index_path = index_path
+        self.embedding_function = embedding_function
+        self.k = k
+        self.max_partitions = max_partitions
+        self.index = LoadedIndex(index_path, max_partitions)
+        self._lock = threading.Lock()
+
+    def current_index(self) -> LoadedIndex:
+        """The loaded index, reloaded first if the one on disk changed"""
+        embeddings_path = os.path.join(self.index_path, EMBEDDINGS_FILE)
+        if index_version(embeddings_path) != self.index.version:
+            with self._lock:
+                if index_version(embeddings_path) != self.index.version:
+                    try:
+                        self.index = LoadedIndex(self.index_path, self.max_partitions)
+                        print(f"Reloaded NumPy index with {len(self.index.notes)} notes from {self.index_path}")
+                    except (OSError, ValueError) as e:
+                        # Caught between two rewrites; the next search tries again
+                        print(f"Could not reload NumPy index: {e}")
+        return self.index
+
+    @staticmethod
+    def partition(index: LoadedIndex, where: dict | None) -> np.ndarray | None:
+        """Row indices of the notes matching a `where` filter, or None for every note"""
+        if not where:
+            return None
+        return index.partitions.get(where, lambda: np.array(
+            [i for i, note in enumerate(index.notes) if where_matches(note['metadata'], where)],
+            dtype=np.int64,
+        ))
+
+    def __call__(self, query: str, k: int | None = None, max_distance: float | None = None, where: dict | None = None) -> list[dotdict]:
+        return self.search_batch([query], k=k, max_distance=max_distance, where=where)[0]
+
+    def search_batch(self, queries: list[str], k: int | None = None, max_distance: float | None = None, where: dict | None = None) -> list[list[dotdict]]:
+        """Search several queries with one matrix product.
+
+        Args:
+            queries (list[str]): The queries to search for.
+            k (int): Number of results per query.
+            max_distance (float): Drop results whose cosine distance is above this value.
+            where (dict): Only search the notes whose metadata matches this filter.
+
+        Returns:
+            list[list[dotdict]]: Results per query, closest first.
+        """
+        index = self.current_index()
+        rows = self.partition(index, where)
+        embeddings = index.embeddings if rows is None else index.embeddings[rows]
+        k = min(k or self.k, len(embeddings))
+        if k == 0:
+            return [[] for _ in queries]
+        query_embeddings = np.asarray(self.embedding_function(queries), dtype=np.float32)
+        query_embeddings /= np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+        distances = 1.0 - query_embeddings @ embeddings.T
+
+        # argpartition keeps the top-k selection linear in the number of notes
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(distances, top):
+            candidates = candidates[np.argsort(row[candidates])]
+            if max_distance is not None:
+                candidates = candidates[row[candidates] <= max_distance]
+            notes = candidates if rows is None else rows[candidates]
+            results.append([
+                dotdict({
+                    'id': index.notes[i]['id'],
+                    'score': float(distance),
+                    'long_text': index.notes[i]['document'],
+                    'metadatas': index.notes[i]['metadata'],
+                })
+                for i, distance in zip(notes, row[candidates])
+            ])
+        return results
@@ -0,0 +1,207 @@
+import time
+import asyncio
+from datetime import datetime
+from agent_scheduler import AgentScheduler
+from call_memory import CallMemory
+from metrics import LatencyRecorder, current_recorder, metrics_registry
+from usage import Usage, metered
+
+# Passed down a stage queue once the stage upstream of it is done
+STAGE_DONE = None
+
+
+class CallPipeline:
+    """Asyncio pipeline from transcriptions to published agent results.
+
+    Stages, connected by bounded queues:
+        ingest -> windowing -> retrieval -> reasoning -> publishing
+
+    Ingest reads the transcription events and reports every one of them, windowing buffers the
+    final utterances into overlapping windows and skips those the runtime's intent gate
+    rejects, retrieval searches the notes for each window,
+    reasoning runs the agent on the async LM path through an `AgentScheduler` (unless the
+    runtime's response cache already has the answer), and publishing
+    hands the predictions to the UI. With `on_token`, the agent's answer is streamed to it
+    token by token while it is generated, and `on_window_done` is called once the agent is
+    done with a window, whether its result is then published, suppressed or the agent failed. With `deduplicate`, a `CallMemory` skips windows whose
+    retrieval set adds nothing new and suppresses near-duplicate results. The pipeline ends
+    when the event stream does.
+
+    Every stage records its durations in `latency`, from the final transcription to the
+    rendered result; the agent's ReAct steps, LM and tool calls are recorded into it too,
+    through the `current_recorder` context variable.
+    """
+    def __init__(
+        self,
+        runtime,
+        on_transcription,
+        on_result,
+        call_id: str = "call",
+        buffer_size: int = 4,
+        buffer_overlap: int = 2,
+        queue_size: int = 4,
+        retrieval_concurrency: int = 1,
+        reasoning_concurrency: int = 2,
+        reasoning_queue_depth: int = 1,
+        stale_policy: str = "drop",
+        deduplicate: bool = True,
+        on_token=None,
+        on_window_done=None,
+    ):
+        self.runtime = runtime
+        self.on_transcription = on_transcription
+        self.on_result = on_result
+        self.call_id = call_id
+        self.buffer_size = buffer_size
+        self.buffer_overlap = buffer_overlap
+        self.queue_size = queue_size
+        self.retrieval_concurrency = retrieval_concurrency
+        self.windows = 0
+        self.windows_skipped = 0
+        self.agent_latencies = []
+        self.deduplicate = deduplicate
+        self.on_token = on_token
+        self.on_window_done = on_window_done
+        self.times_to_first_token = []
+        self.memory = CallMemory()
+        self.latency = LatencyRecorder()
+        self.scheduler = AgentScheduler(
+            self._reason,
+            max_workers=reasoning_concurrency,
+            queue_depth=reasoning_queue_depth,
+            max_pending=queue_size,
+            stale_policy=stale_policy,
+        )
+
+    async def run(self, events):
+        """Run every stage until the transcription events end and the last result is published"""
+        self._utterances = asyncio.Queue(self.queue_size)
+        self._windows = asyncio.Queue(self.queue_size)
+        self._results = asyncio.Queue(self.queue_size)
+        metrics_registry.register(self.call_id, self.latency)
+        # Set before the stage tasks are created, so they all inherit it
+        token = current_recorder.set(self.latency)
+        try:
+            await asyncio.gather(
+                self._ingest(events),
+                self._windowing(),
+                self._retrieval(),
+                self._reasoning(),
+                self._publishing(),
+            )
+        finally:
+            current_recorder.reset(token)
+
+    async def _ingest(self, events):
+        async for transcription in events:
+            self.on_transcription(transcription)
+            if transcription['type'] == 'final':
+                if 'published_at' in transcription:
+                    self.latency.record("stt_final_delivery", time.perf_counter() - transcription['published_at'])
+                await self._utterances.put(transcription)
+        await self._utterances.put(STAGE_DONE)
+
+    async def _windowing(self):
+        buffer, arrivals = [], []
+        while (transcription := await self._utterances.get()) is not STAGE_DONE:
+            buffer.append(f"Speaker {transcription['speaker_id']}: {transcription['text']}")
+            arrivals.append(transcription.get('published_at', time.perf_counter()))
+            if len(buffer) >= self.buffer_size:
+                text = "\n".join(buffer[-self.buffer_size:])
+                utterance_at = arrivals[-1]
+                self.latency.record("buffer_fill", time.perf_counter() - arrivals[-self.buffer_size])
+                buffer = buffer[-self.buffer_overlap:] if self.buffer_overlap else []
+                arrivals = arrivals[-self.buffer_overlap:] if self.buffer_overlap else []
+                self.windows += 1
+                if not self.runtime.has_intent(text):
+                    self.windows_skipped += 1
+                    print(f"skipping window without intent for call {self.call_id}")
+                    continue
+                await self._windows.put({'text': text, 'timestamp': datetime.now(), 'utterance_at': utterance_at})
+        for _ in range(self.retrieval_concurrency):
+            await self._windows.put(STAGE_DONE)
+
+    async def _retrieval(self):
+        async def worker():
+            while (window := await self._windows.get()) is not STAGE_DONE:
+                try:
+                    with self.latency.timer("retrieval"):
+                        window['search_results'] = await asyncio.to_thread(self.runtime.prefetch_window, window['text'])
+                    window['retrieval_set'] = self.runtime.retrieval_set(window['text'], window['search_results'])
+                except Exception as e:
+                    print(f"Error in retrieval stage: {e}")
+                if self.deduplicate and 'retrieval_set' in window and self.memory.is_redundant(window['retrieval_set']):
+                    print(f"skipping window with unchanged retrieval set for call {self.call_id}")
+                    continue
+                await self.scheduler.submit(self.call_id, window)
+
+        await asyncio.gather(*(worker() for _ in range(self.retrieval_concurrency)))
+        await self.scheduler.close()
+
+    async def _reasoning(self):
+        await self.scheduler.run()
+        await self._results.put(STAGE_DONE)
+
+    def _window_done(self, window):
+        if self.on_window_done:
+            try:
+                self.on_window_done(window)
+            except Exception as e:
+                print(f"Error in window done callback: {e}")
+
+    async def _reason(self, call_id, window, queue_wait):
+        try:
+            await self._run_agent(call_id, window, queue_wait)
+        except Exception:
+            # The scheduler reports the error; the window is never published
+            self._window_done(window)
+            raise
+
+    async def _run_agent(self, call_id, window, queue_wait):
+        print(f"running agent for call {call_id} after waiting {queue_wait:.2f}s in queue")
+        self.latency.record("queue_wait", queue_wait)
+        start = time.perf_counter()
+        retrieval_set = window.get('retrieval_set')
+        prediction = await asyncio.to_thread(self.runtime.cached_prediction, window['text'], retrieval_set)
+        cached = prediction is not None
+        time_to_first_token = None
+        usage = Usage()  # the LM calls of this window only, while other windows run concurrently
+        if not cached:
+            with metered(usage):
+                if self.on_token:
+                    prediction, time_to_first_token = await self.runtime.astream(
+                        window['text'], lambda field, text: self.on_token(window, field, text)
+                    )
+                else:
+                    prediction = await self.runtime.acall(window['text'])
+            await asyncio.to_thread(self.runtime.cache_prediction, window['text'], retrieval_set, prediction)
+        agent_latency = time.perf_counter() - start
+        self.latency.record("response_cache_hit" if cached else "agent", agent_latency)
+        if not cached:
+            self.agent_latencies.append(agent_latency)
+        if time_to_first_token is not None:
+            self.times_to_first_token.append(time_to_first_token)
+        await self._results.put(dict(
+            window,
+            prediction=prediction,
+            queue_wait=queue_wait,
+            agent_latency=agent_latency,
+            cached=cached,
+            time_to_first_token=time_to_first_token,
+            usage=usage.as_dict(),
+        ))
+
+    async def _publishing(self):
+        while (result := await self._results.get()) is not STAGE_DONE:
+            self._window_done(result)
+            if self.deduplicate and self.memory.is_duplicate(result['prediction']):
+                print(f"suppressing duplicate result for call {self.call_id}")
+                continue
+            self.memory.remember(result.get('retrieval_set', frozenset()), result['prediction'])
+            try:
+                with self.latency.timer("render"):
+                    self.on_result(result)
+            except Exception as e:
+                print(f"Error in publishing stage: {e}")
+            if 'utterance_at' in result:
+                self.latency.record("end_to_end", time.perf_counter() - result['utterance_at'])
@@ -1,37 +1,197 @@
 import chromadb.utils.embedding_functions as embedding_functions
 import os
-import uuid
+import time
+import hashlib
 import chromadb
 import yaml
 import argparse
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from numpy_retriever import default_index_path, write_numpy_index
+from lexical_index import BM25Index, default_lexical_index_path
+from response_cache import collection_version_path, write_collection_version
 from dotenv import load_dotenv
 load_dotenv()
 
+NOTES_FILE_NAME = 'call_notes.txt'
+
 def load_notes(file_path):
     """Load notes from a text file, where each line is a note."""
     with open(file_path, 'r') as f:
         return [line.strip() for line in f if line.strip()]
 
+def note_id(source, note):
+    """Content-hash id of a note, stable across runs"""
+    return hashlib.sha256(f"{source}\n{note}".encode()).hexdigest()
+
+def chunk_id(parent_id, chunk):
+    """Content-hash id of a chunk, so re-chunking with other settings replaces the old chunks"""
+    return hashlib.sha256(f"{parent_id}\n{chunk}".encode()).hexdigest()
+
+def create_text_splitter(chunk_size=128, chunk_overlap=16):
+    """Token-aware splitter for long advisor notes, or None to embed every note whole"""
+    if not chunk_size:
+        return None
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+def notes_metadata(notes_file, client_id=None, topic=None, notes_date=None):
+    """Partition metadata of a notes file: client id, topic and date.
+
+    The topic defaults to the folder of the file (synthetic_data/<topic>/call_notes.txt) and the
+    date to the day the file was last modified. Notes without a client id are only found by
+    unscoped searches.
+    """
+    metadata = {
+        "topic": topic or os.path.basename(os.path.dirname(os.path.abspath(notes_file))),
+        "date": notes_date or date.fromtimestamp(os.path.getmtime(notes_file)).isoformat(),
+    }
+    if client_id:
+        metadata["client_id"] = client_id
+    return metadata
+
+def split_notes(source, notes, text_splitter=None, metadata=None):
+    """Split notes into the documents to embed.
+
+    Returns:
+        dict: Document id -> (text, metadata). Chunks keep the id of their parent note in their
+        metadata, so sibling chunks can be collapsed at retrieval time, plus the partition
+        metadata of their notes file.
+    """
+    documents = {}
+    for note in notes:
+        parent_id = note_id(source, note)
+        chunks = text_splitter.split_text(note) if text_splitter else [note]
+        for i, chunk in enumerate(chunks):
+            id = chunk_id(parent_id, chunk) if len(chunks) > 1 else parent_id
+            documents[id] = (chunk, {**(metadata or {}), "source": source, "parent_id": parent_id, "chunk_index": i})
+    return documents
+
+def find_notes_files(notes_dir):
+    """Find every notes file under a folder, e.g. one per topic under synthetic_data/"""
+    return sorted(
+        os.path.join(root, NOTES_FILE_NAME)
+        for root, _, files in os.walk(notes_dir)
+        if NOTES_FILE_NAME in files
+    )
+
+def notes_source(notes_file):
+    """Identity of a notes file in the collection: its resolved path, the same however it is typed"""
+    return os.path.realpath(notes_file)
+
+def purge_stale_documents(collection, notes_files):
+    """Delete documents the incremental ingest would never match.
+
+    These are documents without a `source`, from collections built before incremental
+    ingestion, and documents of these notes files stored under an unresolved path.
+
+    Returns:
+        int: Number of documents deleted.
+    """
+    sources = {notes_source(notes_file) for notes_file in notes_files}
+    stored = collection.get(include=["metadatas"])
+    stale = [
+        id for id, metadata in zip(stored['ids'], stored['metadatas'])
+        if not (metadata or {}).get('source')
+        or (metadata['source'] not in sources and notes_source(metadata['source']) in sources)
+    ]
+    if stale:
+        collection.delete(ids=stale)
+        print(f"Deleted {len(stale)} documents without a source or stored under an unresolved path")
+    return len(stale)
+
+def embed_with_retry(ef, documents, max_retries=3):
+    """Embed a batch of documents, retrying with exponential backoff on failure"""
+    for attempt in range(max_retries + 1):
+        try:
+            return ef(documents)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt
+            print(f"Embedding batch failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+def ingest_notes_file(collection, ef, notes_file, batch_size=64, concurrency=4, max_retries=3, text_splitter=None, metadata=None):
+    """Bring the collection in sync with a notes file.
+
+    Only new or changed notes are embedded, in bounded batches sent concurrently, and notes
+    removed from the file are deleted from the collection. Unchanged notes whose partition
+    metadata changed are re-tagged without being embedded again.
+
+    Returns:
+        tuple[int, int]: Number of documents upserted and deleted.
+    """
+    source = notes_source(notes_file)
+    documents = split_notes(source, load_notes(notes_file), text_splitter, metadata)
+    stored = collection.get(where={"source": source}, include=["metadatas"])
+    existing = set(stored['ids'])
+
+    removed = list(existing - documents.keys())
+    if removed:
+        collection.delete(ids=removed)
+
+    retagged = [id for id, stored_metadata in zip(stored['ids'], stored['metadatas']) if id in documents and stored_metadata != documents[id][1]]
+    if retagged:
+        collection.update(ids=retagged, metadatas=[documents[id][1] for id in retagged])
+
+    new_ids = [id for id in documents if id not in existing]
+    batches = [new_ids[i:i + batch_size] for i in range(0, len(new_ids), batch_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(embed_with_retry, ef, [documents[id][0] for id in batch], max_retries): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            collection.upsert(
+                ids=batch,
+                documents=[documents[id][0] for id in batch],
+                embeddings=future.result(),
+                metadatas=[documents[id][1] for id in batch],
+            )
+    print(f"{notes_file}: {len(new_ids)} documents added, {len(removed)} removed, {len(documents) - len(new_ids)} unchanged ({len(retagged)} re-tagged)")
+    return len(new_ids), len(removed)
+
 def main():
     parser = argparse.ArgumentParser(description='Prepare vector database from notes')
-    parser.add_argument('--notes-file', type=str, required=True,
-                      help='Path to the text file containing notes (one per line)')
+    parser.add_argument('--notes-file', type=str, nargs='+', default=[],
+                      help='Path to the text file(s) containing notes (one per line)')
+    parser.add_argument('--notes-dir', type=str,
+                      help=f'Folder to search for {NOTES_FILE_NAME} files, e.g. synthetic_data/')
+    parser.add_argument('--batch-size', type=int, default=64,
+                      help='Number of notes per embedding request')
+    parser.add_argument('--concurrency', type=int, default=4,
+                      help='Number of embedding requests sent concurrently')
+    parser.add_argument('--max-retries', type=int, default=3,
+                      help='Retries of a failed embedding request')
+    parser.add_argument('--chunk-size', type=int, default=128,
+                      help='Maximum tokens per embedded chunk of a note (0 embeds every note whole)')
+    parser.add_argument('--chunk-overlap', type=int, default=16,
+                      help='Tokens shared by consecutive chunks of a note')
+    parser.add_argument('--client-id', type=str,
+                      help='Client the notes belong to, used to scope retrieval to that client (not with --notes-dir)')
+    parser.add_argument('--topic', type=str,
+                      help='Topic of the notes (defaults to the folder of each notes file)')
+    parser.add_argument('--date', type=str,
+                      help='Date of the notes, YYYY-MM-DD (defaults to the notes file modification date)')
     args = parser.parse_args()
 
+    notes_files = args.notes_file + (find_notes_files(args.notes_dir) if args.notes_dir else [])
+    if not notes_files:
+        parser.error('provide --notes-file or --notes-dir')
+    if args.client_id and args.notes_dir:
+        # The files under a folder belong to different clients; ingest each client's files with --notes-file
+        parser.error('--client-id applies to --notes-file only, not to every file under --notes-dir')
+
     # Load config
     with open('config.yaml', 'r') as file:
         config = yaml.safe_load(file)
 
-    # Load notes from file
-    notes = load_notes(args.notes_file)
-
-    documents = [
-        {
-            "details": note
-        }
-        for note in notes
-    ]
-
     ef = embedding_functions.OpenAIEmbeddingFunction(
         api_key=os.getenv('AZURE_OPENAI_API_KEY'),
         api_base=os.getenv('AZURE_OPENAI_API_BASE'),
@@ -41,22 +201,43 @@ def main():
     )
 
     chroma_client = chromadb.PersistentClient(path=config.get('db_persist_path'))
+    collection = chroma_client.get_or_create_collection(
+        config.get('db_collection_name'),
+        metadata={"hnsw:space": "cosine"},
+        embedding_function=ef
+    )
 
-    try:
-        collection = chroma_client.get_collection(
-            config.get('db_collection_name'), 
-            embedding_function=ef
-        )
-    except:
-        collection = chroma_client.create_collection(
-            config.get('db_collection_name'),
-            metadata={"hnsw:space": "cosine"},
-            embedding_function=ef
-        )
-        collection.add(
-            documents=[d['details'] for d in documents],
-            ids=[str(uuid.uuid4()) for _ in documents],
+    text_splitter = create_text_splitter(args.chunk_size, args.chunk_overlap)
+    start = time.perf_counter()
+    upserted, deleted = 0, purge_stale_documents(collection, notes_files)
+    for notes_file in notes_files:
+        file_upserted, file_deleted = ingest_notes_file(
+            collection, ef, notes_file,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            text_splitter=text_splitter,
+            metadata=notes_metadata(notes_file, args.client_id, args.topic, args.date),
         )
+        upserted += file_upserted
+        deleted += file_deleted
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {len(notes_files)} notes files: {upserted} documents upserted, {deleted} deleted "
+          f"in {elapsed:.1f}s ({upserted / elapsed if elapsed else 0.0:.1f} notes/sec)")
+
+    # Export the embeddings for the in-process NumPy retriever backend
+    index = collection.get(include=["embeddings", "documents", "metadatas"])
+    index_path = default_index_path(config)
+    write_numpy_index(index_path, index['ids'], index['documents'], index['embeddings'], index['metadatas'])
+    print(f"Wrote NumPy index with {len(index['ids'])} notes to {index_path}")
+
+    # Build the BM25 index for hybrid retrieval
+    lexical_index_path = default_lexical_index_path(config)
+    BM25Index(index['ids'], index['documents'], index['metadatas']).save(lexical_index_path)
+    print(f"Wrote BM25 index with {len(index['ids'])} notes to {lexical_index_path}")
+
+    # A new collection version invalidates the cached agent responses
+    write_collection_version(collection_version_path(config), index['ids'])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
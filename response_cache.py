@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+def collection_version_path(config: dict) -> str:
+    """File holding the version of the notes collection, written by `prepare_vector_db.py`"""
+    return os.path.join(config.get('db_persist_path'), f"{config.get('db_collection_name')}_version")
+
+
+def collection_version(ids: list[str]) -> str:
+    """Version of a collection: a hash of its document ids, which are content hashes"""
+    return hashlib.sha256("\n".join(sorted(ids)).encode()).hexdigest()
+
+
+def write_collection_version(path: str, ids: list[str]):
+    with open(path, 'w') as file:
+        file.write(collection_version(ids))
+
+
+def retrieval_key(namespace: str, retrieval_set) -> str:
+    """Cache key of a retrieval set: the notes and tickers a window surfaces"""
+    return json.dumps([namespace, sorted(map(list, retrieval_set))])
+
+
+class ResponseCache:
+    """Semantic cache of agent responses.
+
+    An entry is found for a window when it has the same retrieval set (note ids and tickers)
+    as a cached one and their embeddings are at least `similarity` cosine-similar, so a
+    recurring question about the same products skips the agent. Entries expire after `ttl`
+    seconds, the least recently used are evicted beyond `max_size`, and an optional SQLite
+    file keeps them across restarts. The whole cache is dropped when the collection version
+    file changes, i.e. when the notes are re-ingested.
+    """
+    def __init__(
+        self,
+        similarity: float = 0.95,
+        max_size: int = 256,
+        ttl: float | None = None,
+        path: str | None = None,
+        version_path: str | None = None,
+    ):
+        self.similarity = similarity
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_path = version_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # entry id -> (key, created, embedding, response)
+        self._version = None
+        self._version_mtime = None
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(id TEXT PRIMARY KEY, version TEXT, key TEXT, embedding BLOB, response TEXT, created REAL)"
+            )
+            self._db.commit()
+        with self._lock:
+            self._check_version()
+
+    def _check_version(self):
+        """Drop every entry when the collection version changed since the last check"""
+        if self.version_path is None:
+            if self._version is None:
+                self._load("")
+            return
+        try:
+            mtime = os.path.getmtime(self.version_path)
+        except OSError:
+            mtime = None
+        if mtime == self._version_mtime and self._version is not None:
+            return
+        self._version_mtime = mtime
+        version = ""
+        if mtime is not None:
+            with open(self.version_path, 'r') as file:
+                version = file.read().strip()
+        if version == self._version:
+            return
+        if self._version is not None:
+            self.invalidations += 1
+        self._load(version)
+
+    def _load(self, version: str):
+        """Switch to a collection version, keeping only the stored entries made for it"""
+        self._version = version
+        self._entries.clear()
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE version != ?", (version,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id, key, embedding, response, created FROM responses ORDER BY created DESC LIMIT ?",
+                (self.max_size,),
+            ).fetchall()
+            for id, key, blob, response, created in reversed(rows):
+                self._entries[id] = (key, created, np.frombuffer(blob, dtype=np.float32), json.loads(response))
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def get(self, key: str, embedding) -> dict | None:
+        """Cached response for a retrieval key and window embedding, or None on a miss"""
+        embedding = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            best, best_similarity = None, self.similarity
+            for id, (entry_key, created, entry_embedding, response) in list(self._entries.items()):
+                if self.ttl is not None and now - created >= self.ttl:
+                    self._delete(id)
+                    continue
+                if entry_key != key:
+                    continue
+                similarity = float(embedding @ entry_embedding)
+                if similarity >= best_similarity:
+                    best, best_similarity = id, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][3]
+
+    def put(self, key: str, embedding, response: dict):
+        """Cache a response; it must be JSON-serializable"""
+        embedding = self._normalize(embedding)
+        created = time.time()
+        id = hashlib.sha256(key.encode() + embedding.tobytes()).hexdigest()
+        with self._lock:
+            self._check_version()
+            self._entries[id] = (key, created, embedding, response)
+            self._entries.move_to_end(id)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (id, version, key, embedding, response, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    (id, self._version, key, embedding.tobytes(), json.dumps(response, default=str), created),
+                )
+                self._db.commit()
+            while len(self._entries) > self.max_size:
+                self._delete(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _delete(self, id: str):
+        del self._entries[id]
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE id = ?", (id,))
+            self._db.commit()
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            'response_cache_hits': self.hits,
+            'response_cache_misses': self.misses,
+            'response_cache_evictions': self.evictions,
+            'response_cache_invalidations': self.invalidations,
+            'response_cache_hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,107 @@
+import bisect
+import streamlit as st
+
+
+def render_card(result: dict, number: int):
+    """Render one agent result into the current Streamlit container"""
+    st.subheader(f"ℹ️ Relevant Information {number}")
+    st.text(result['prediction'].relevant_information)
+
+    st.subheader("📚 References")
+    st.text(result['prediction'].citations)
+
+    with st.expander("💬 View Agent Input", expanded=False):
+        st.text(result['input_text'])
+
+    with st.expander("💭 View Reasoning", expanded=False):
+        st.text(result['prediction'].reasoning)
+
+    with st.expander("🔍 View Trajectory", expanded=False):
+        st.write(result['prediction'].trajectory)
+
+    st.markdown("---")
+
+
+class ResultsFeed:
+    """Incremental, newest-first view of the agent results.
+
+    Results are kept ordered by timestamp. The newest `page_size` are shown as full cards,
+    each in its own placeholder, so adding a result renders only its card (and the cards
+    after it, when it arrives out of order). When the page is full it is collapsed into the
+    earlier results below it, which keep the last `max_history` results as one collapsed
+    card each. A result is numbered by its arrival, so inserting one never renumbers others.
+    """
+    def __init__(self, page_size: int = 10, max_history: int = 50):
+        self.page_size = page_size
+        self.max_history = max_history
+        self.results = []  # (timestamp, number, result), oldest first
+        self.page_start = 0  # index of the first result of the current page
+        self.count = 0
+        self._slots = []
+        self._history = None
+
+    def mount(self, placeholder):
+        """Lay out the feed in a placeholder and render what it holds; needed after every script rerun"""
+        with placeholder.container():
+            # Slots are filled from the bottom up, so the newest card is on top
+            self._slots = [st.empty() for _ in range(self.page_size)]
+            self._history = st.empty()
+        for i in range(self.page_start, len(self.results)):
+            self._render_slot(i)
+        self._render_history()
+
+    def add(self, result: dict):
+        """Insert a result in timestamp order and render it"""
+        if len(self.results) - self.page_start >= self.page_size:
+            self._roll_over()
+        self.count += 1
+        timestamps = [entry[0] for entry in self.results[self.page_start:]]
+        index = self.page_start + bisect.bisect_right(timestamps, result['timestamp'])
+        if index == self.page_start and self.page_start > 0 and result['timestamp'] < self.results[self.page_start - 1][0]:
+            # Older than the current page: it belongs to the earlier results
+            history = [entry[0] for entry in self.results[:self.page_start]]
+            self.results.insert(bisect.bisect_right(history, result['timestamp']), (result['timestamp'], self.count, result))
+            self.page_start += 1
+            self._trim()
+            self._render_history()
+            return
+        self.results.insert(index, (result['timestamp'], self.count, result))
+        for i in range(index, len(self.results)):
+            self._render_slot(i)
+
+    def _slot(self, i: int):
+        return self._slots[self.page_size - 1 - (i - self.page_start)]
+
+    def _render_slot(self, i: int):
+        if not self._slots:
+            return
+        _, number, result = self.results[i]
+        with self._slot(i).container():
+            render_card(result, number)
+
+    def _roll_over(self):
+        """Move the full page to the earlier results and start an empty one"""
+        self.page_start = len(self.results)
+        self._trim()
+        for slot in self._slots:
+            slot.empty()
+        self._render_history()
+
+    def _trim(self):
+        excess = self.page_start - self.max_history
+        if excess > 0:
+            del self.results[:excess]
+            self.page_start -= excess
+
+    def _render_history(self):
+        if self._history is None or self.page_start == 0:
+            return
+        with self._history.container():
+            st.caption(f"Earlier results (last {self.page_start})")
+            for _, number, result in reversed(self.results[:self.page_start]):
+                with st.expander(f"ℹ️ Relevant Information {number} · {result['timestamp']:%H:%M:%S}", expanded=False):
+                    st.text(result['prediction'].relevant_information)
+                    st.markdown("**📚 References**")
+                    st.text(result['prediction'].citations)
+                    st.markdown("**💬 Agent Input**")
+                    st.text(result['input_text'])
@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(text: str) -> str:
+    """Lower-cased text with its whitespace collapsed, the key prefetched results are reused under"""
+    return " ".join(text.lower().split())
+
+
+class SpeculativeRetriever:
+    """Prefetches note searches ahead of the agent's tool calls.
+
+    Once `enabled`, interim hypotheses are debounced and searched in the background, and the
+    pipeline's retrieval stage prefetches each window, so a `retrieve_notes` call for the
+    same text (the window itself in single-pass mode) finds the results already warm. A
+    prefetched result is only reused for a query equal to the text it was fetched for, once
+    normalized, and only within the window it was fetched in.
+    """
+    def __init__(self, search_fn, debounce: float = 0.3, max_entries: int = 32):
+        self.search_fn = search_fn
+        self.debounce = debounce
+        self.max_entries = max_entries
+        self.enabled = False
+        self.prefetches = 0
+        self.lookups = 0
+        self.hits = 0
+        self.time_saved = 0.0
+        self._entries = OrderedDict()  # prefetched text -> (terms, results, latency)
+        self._latest = None
+        self._latest_at = 0.0
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def on_interim(self, text: str):
+        """Record the newest interim hypothesis; it is searched once it has been stable for `debounce` seconds"""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._prefetch_loop, name="SpeculativeRetrieval", daemon=True)
+                self._thread.start()
+            self._latest = text
+            self._latest_at = time.monotonic()
+            self._condition.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or self._latest is not None)
+                if not self._running:
+                    return
+                remaining = self._latest_at + self.debounce - time.monotonic()
+                if remaining > 0:
+                    # A newer hypothesis restarts the debounce window
+                    self._condition.wait(timeout=remaining)
+                    continue
+                text, self._latest = self._latest, None
+                if normalize_query(text) in self._entries:
+                    continue
+            try:
+                self.prefetch(text)
+            except Exception as e:
+                print(f"Speculative retrieval failed: {e}")
+
+    def prefetch(self, text: str) -> list:
+        """Search the notes for a text and keep the results for later lookups"""
+        start = time.perf_counter()
+        results = self.search_fn(text)
+        latency = time.perf_counter() - start
+        key = normalize_query(text)
+        with self._condition:
+            self.prefetches += 1
+            self._entries[key] = (results, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def start_window(self):
+        """Forget the prefetches of earlier windows"""
+        with self._condition:
+            self._entries.clear()
+
+    def lookup(self, query: str):
+        """Return the results prefetched for this query, or None on a miss or when disabled"""
+        if not self.enabled:
+            return None
+        with self._condition:
+            self.lookups += 1
+            entry = self._entries.get(normalize_query(query))
+            if entry is None:
+                return None
+            self.hits += 1
+            self.time_saved += entry[1]
+            return entry[0]
+
+    def stop(self):
+        """Stop the background prefetch thread"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get_stats(self) -> dict:
+        """Prefetch hit rate and retrieval time saved"""
+        return {
+            'prefetch_count': self.prefetches,
+            'prefetch_lookups': self.lookups,
+            'prefetch_hits': self.hits,
+            'prefetch_hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'prefetch_time_saved_seconds': self.time_saved,
+        }
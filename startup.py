@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import functools
+import subprocess
+
+# Imports that dominate the cold start of the app; "app" is what app.py imports before its first render
+STARTUP_IMPORTS = {
+    "dspy": "import dspy",
+    "mlflow": "import mlflow",
+    "chromadb": "import chromadb",
+    "streamlit": "import streamlit",
+    "speech_sdk": "import azure.cognitiveservices.speech",
+    "bank_call_agent": "import bank_call_agent",
+    "app": "import streamlit, bank_call_agent, call_session, results_view, lexical_index, metrics",
+}
+
+_init_seconds = {}  # resource name -> seconds its first build took
+_init_lock = threading.Lock()
+
+
+def lazy_resource(build):
+    """Build a process-wide resource on its first use, once even when first used from several threads"""
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(build)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    start = time.perf_counter()
+                    built.append(build())
+                    with _init_lock:
+                        _init_seconds[build.__name__] = time.perf_counter() - start
+        return built[0]
+
+    return get
+
+
+def init_timings() -> dict:
+    """Seconds taken to build each lazy resource built so far in this process"""
+    with _init_lock:
+        return {f"init_{name}_seconds": seconds for name, seconds in _init_seconds.items()}
+
+
+def cold_import_seconds(statement: str) -> float:
+    """Seconds an import statement takes in a fresh interpreter, with the dependencies it imports"""
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def startup_report(imports: dict = STARTUP_IMPORTS) -> dict:
+    """Cold import times, then the time to build each lazy resource and the agent runtime"""
+    report = {}
+    for name, statement in imports.items():
+        try:
+            report[f"import_{name}_seconds"] = cold_import_seconds(statement)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            print(f"Could not time `{statement}`: {e}")
+    from bank_call_agent import AgentRuntime, get_config, warm_up_resources
+    warm_up_resources()
+    start = time.perf_counter()
+    AgentRuntime(model_deployment_name=get_config().get('azure_deployment_model'))
+    report['init_agent_runtime_seconds'] = time.perf_counter() - start
+    report.update(init_timings())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Break down the cold start of the app into import and initialization times')
+    parser.add_argument('--output', type=str,
+                      help='JSON file to also write the report to')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report = startup_report()
+    for name, seconds in report.items():
+        print(f"{name:<60} {seconds:8.3f}s")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Wrote startup report to {args.output}")
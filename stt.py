@@ -1,19 +1,37 @@
 import os
+import json
 import time
+import random
+import subprocess
 import queue
+import asyncio
 import threading
+from functools import partial
 import azure.cognitiveservices.speech as speechsdk
 from dotenv import load_dotenv
 load_dotenv()
 from streamlit.runtime.scriptrunner import add_script_run_ctx
 
 
+# Queued to wake the consumer when a speaker has a new interim hypothesis
+INTERIM_READY = {'type': 'interim_ready'}
+
+
 class TranscriptionManager:
-    def __init__(self):
+    def __init__(self, min_interim_interval: float = 0.0):
         self.transcription_queue = queue.Queue()
         self.is_running = False
         self._consumer_callback = None
         self.complete_transcription = []
+        # Interim hypotheses are coalesced per speaker, only the newest one is kept
+        self.min_interim_interval = min_interim_interval
+        self.coalesced_interims = 0
+        self._pending_interims = {}
+        self._last_interim_emit = {}
+        self._interim_lock = threading.Lock()
+        # Set while an asyncio consumer is iterating over events()
+        self._loop = None
+        self._wakeup = None
 
     def set_consumer_callback(self, callback):
         """Set the callback function that will process transcriptions"""
@@ -23,42 +41,141 @@ class TranscriptionManager:
         """Get the complete transcription as a list of dictionaries"""
         return self.complete_transcription
 
+    def publish(self, transcription):
+        """Publish a transcription from the recognizer.
+
+        Final transcriptions are always queued. Interim ones replace the pending interim of
+        the same speaker, so a slow consumer only ever sees the newest hypothesis.
+        """
+        speaker_id = transcription['speaker_id']
+        with self._interim_lock:
+            if transcription['type'] == 'final':
+                # The final result supersedes the speaker's pending hypothesis
+                if self._pending_interims.pop(speaker_id, None) is not None:
+                    self.coalesced_interims += 1
+                self.transcription_queue.put(transcription)
+            else:
+                if speaker_id in self._pending_interims:
+                    self.coalesced_interims += 1
+                else:
+                    self.transcription_queue.put(INTERIM_READY)
+                self._pending_interims[speaker_id] = transcription
+        self._notify()
+
+    def close(self):
+        """Signal the consumer that the session has stopped"""
+        self.transcription_queue.put(None)
+        self._notify()
+
+    def _notify(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take_due_interims(self):
+        """Pop the pending interims whose speaker is past the minimum emit interval.
+
+        Returns:
+            tuple: The interims to emit, and the seconds until the next pending one is due (or None).
+        """
+        now = time.monotonic()
+        due, next_due = [], None
+        with self._interim_lock:
+            for speaker_id in list(self._pending_interims):
+                ready_at = self._last_interim_emit.get(speaker_id, 0.0) + self.min_interim_interval
+                if ready_at <= now:
+                    due.append(self._pending_interims.pop(speaker_id))
+                    self._last_interim_emit[speaker_id] = now
+                else:
+                    wait = ready_at - now
+                    next_due = wait if next_due is None else min(next_due, wait)
+        return due, next_due
+
+    def _process(self, transcription):
+        # Store final transcriptions
+        if transcription['type'] == 'final':
+            self.complete_transcription.append(transcription)
+
+        # Process the transcription using callback if available
+        if self._consumer_callback:
+            self._consumer_callback(transcription)
+        else:
+            print(f"\nReceived {transcription['type']} transcription:")
+            print(f"\tText: {transcription['text']}")
+            print(f"\tSpeaker ID: {transcription['speaker_id']}")
+
     def _default_consumer_thread(self):
         """Default consumer function that processes transcriptions from the queue"""
+        next_due = None
         while self.is_running:
             try:
-                # Get transcription from queue, waiting if necessary
-                transcription = self.transcription_queue.get(timeout=1)
+                # Get transcription from queue, waiting until the next held-back interim is due
+                transcription = self.transcription_queue.get(timeout=next_due or 1)
                 
                 # Check for stop signal
                 if transcription is None:
                     print("Consumer received stop signal")
                     break
-                    
-                # Store final transcriptions
-                if transcription['type'] == 'final':
-                    self.complete_transcription.append(transcription)
-                
-                # Process the transcription using callback if available
-                if self._consumer_callback:
-                    self._consumer_callback(transcription)
-                else:
-                    print(f"\nReceived {transcription['type']} transcription:")
-                    print(f"\tText: {transcription['text']}")
-                    print(f"\tSpeaker ID: {transcription['speaker_id']}")
-                
+
+                if transcription is not INTERIM_READY:
+                    self._process(transcription)
+
                 # Mark task as done
                 self.transcription_queue.task_done()
                 
             except queue.Empty:
-                continue
+                pass
+            except Exception as e:
+                print(f"Error in consumer: {e}")
+
+            try:
+                interims, next_due = self._take_due_interims()
+                for interim in interims:
+                    self._process(interim)
             except Exception as e:
                 print(f"Error in consumer: {e}")
 
+    async def events(self):
+        """Asynchronously iterate over the transcriptions until the session stops.
+
+        The asyncio counterpart of the consumer thread: the recognizer wakes the event loop
+        when something is published, so nothing is polled.
+        """
+        self.complete_transcription = []
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # Clear before draining, so a publish that races with the drain still wakes us
+                self._wakeup.clear()
+                while True:
+                    try:
+                        transcription = self.transcription_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if transcription is None:
+                        return
+                    if transcription is not INTERIM_READY:
+                        if transcription['type'] == 'final':
+                            self.complete_transcription.append(transcription)
+                        yield transcription
+
+                interims, next_due = self._take_due_interims()
+                for interim in interims:
+                    yield interim
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=next_due)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = None
+
     def start_consumer(self):
         """Start the consumer thread"""
         self.is_running = True
         self.complete_transcription = []  # Reset transcription at start
+        self._pending_interims = {}
+        self._last_interim_emit = {}
         self.consumer_thread = threading.Thread(
             target=self._default_consumer_thread,
             name="TranscriptionConsumer",
@@ -74,38 +191,236 @@ class TranscriptionManager:
         if hasattr(self, 'consumer_thread'):
             self.consumer_thread.join()
 
-# Create a global instance
-transcription_manager = TranscriptionManager()
+# Audio offsets and durations are reported in 100-nanosecond ticks
+TICKS_PER_SECOND = 10_000_000
 
-def conversation_transcriber_recognition_canceled_cb(evt: speechsdk.SessionEventArgs):
+def conversation_transcriber_recognition_canceled_cb(manager: TranscriptionManager, evt: speechsdk.SessionEventArgs):
     print('Canceled event')
 
-def conversation_transcriber_session_stopped_cb(evt: speechsdk.SessionEventArgs):
+def conversation_transcriber_session_stopped_cb(manager: TranscriptionManager, evt: speechsdk.SessionEventArgs):
     print('SessionStopped event')
-    # Add None to signal the consumer to stop
-    transcription_manager.transcription_queue.put(None)
+    # Signal the consumer to stop
+    manager.close()
 
-def conversation_transcriber_transcribed_cb(evt: speechsdk.SpeechRecognitionEventArgs):
+def conversation_transcriber_transcribed_cb(manager: TranscriptionManager, evt: speechsdk.SpeechRecognitionEventArgs):
     if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
         transcription = {
             'text': evt.result.text,
             'speaker_id': evt.result.speaker_id,
-            'type': 'final'
+            'type': 'final',
+            'audio_end': (evt.result.offset + evt.result.duration) / TICKS_PER_SECOND,
+            'published_at': time.perf_counter(),
         }
-        transcription_manager.transcription_queue.put(transcription)
+        manager.publish(transcription)
 
-def conversation_transcriber_transcribing_cb(evt: speechsdk.SpeechRecognitionEventArgs):
+def conversation_transcriber_transcribing_cb(manager: TranscriptionManager, evt: speechsdk.SpeechRecognitionEventArgs):
     transcription = {
         'text': evt.result.text,
         'speaker_id': evt.result.speaker_id,
         'type': 'interim'
     }
-    transcription_manager.transcription_queue.put(transcription)
+    manager.publish(transcription)
 
-def conversation_transcriber_session_started_cb(evt: speechsdk.SessionEventArgs):
+def conversation_transcriber_session_started_cb(manager: TranscriptionManager, evt: speechsdk.SessionEventArgs):
     print('SessionStarted event')
 
-def recognize_from_file(file_path):
+class PcmAudioSource:
+    """Raw PCM audio, as a format and an iterable of frames.
+
+    Uploaded files, a live microphone or telephony frames all go through this interface.
+    """
+    def __init__(self, frames, sample_rate: int = 16000, bits_per_sample: int = 16, channels: int = 1):
+        self.frames = frames
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+        self.channels = channels
+
+    def frame_bytes(self, frame_ms: int) -> int:
+        """Size of a frame of `frame_ms` milliseconds"""
+        return self.sample_rate * frame_ms // 1000 * self.bits_per_sample // 8 * self.channels
+
+
+def wav_source(data: bytes, frame_ms: int = 100) -> PcmAudioSource:
+    """Stream the PCM samples of an in-memory WAV file in fixed-size frames, without copying the file"""
+    view = memoryview(data)
+    if bytes(view[0:4]) != b'RIFF' or bytes(view[8:12]) != b'WAVE':
+        raise ValueError("Not a WAV file")
+    fmt, position = None, 12
+    while position + 8 <= len(view):
+        chunk_id = bytes(view[position:position + 4])
+        chunk_size = int.from_bytes(view[position + 4:position + 8], 'little')
+        body = position + 8
+        if chunk_id == b'fmt ':
+            fmt = view[body:body + chunk_size]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV data chunk before its format chunk")
+            if int.from_bytes(fmt[0:2], 'little') != 1:
+                raise ValueError("Only PCM WAV files are supported")
+            channels = int.from_bytes(fmt[2:4], 'little')
+            sample_rate = int.from_bytes(fmt[4:8], 'little')
+            bits_per_sample = int.from_bytes(fmt[14:16], 'little')
+            samples = view[body:min(body + chunk_size, len(view))]
+            source = PcmAudioSource(None, sample_rate, bits_per_sample, channels)
+            step = source.frame_bytes(frame_ms)
+            source.frames = (samples[i:i + step] for i in range(0, len(samples), step))
+            return source
+        # Chunks are padded to an even size
+        position = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def mp3_source(data: bytes, frame_ms: int = 100, sample_rate: int = 16000) -> PcmAudioSource:
+    """Decode an in-memory MP3 file to 16-bit mono PCM while streaming it through ffmpeg"""
+    process = subprocess.Popen(
+        ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0', '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+    def feed():
+        view = memoryview(data)
+        try:
+            for i in range(0, len(view), 64 * 1024):
+                process.stdin.write(view[i:i + 64 * 1024])
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    source = PcmAudioSource(None, sample_rate=sample_rate)
+    step = source.frame_bytes(frame_ms)
+
+    def frames():
+        feeder = threading.Thread(target=feed, name="Mp3Feeder", daemon=True)
+        feeder.start()
+        while frame := process.stdout.read(step):
+            yield frame
+        feeder.join()
+        process.wait()
+
+    source.frames = frames()
+    return source
+
+
+def audio_source(data: bytes, file_name: str, frame_ms: int = 100) -> PcmAudioSource:
+    """Streaming PCM source for an uploaded WAV or MP3 file"""
+    if file_name.lower().endswith('.mp3'):
+        return mp3_source(data, frame_ms=frame_ms)
+    return wav_source(data, frame_ms=frame_ms)
+
+
+class TranscriptReplaySource:
+    """A call transcript to replay as transcription events instead of transcribing audio.
+
+    Each utterance is spoken at `words_per_second`, with an interim hypothesis every
+    `interim_words` words and a final result at its end. `jitter` randomly stretches or
+    shortens every step by up to that fraction, from a `seed`ed generator so a replay is
+    deterministic. `speed` scales the pace: 1 is real time, 10 is ten times faster and 0
+    publishes every event without waiting.
+    """
+    def __init__(
+        self,
+        utterances: list[dict],
+        words_per_second: float = 2.5,
+        interim_words: int = 3,
+        jitter: float = 0.2,
+        pause_seconds: float = 0.5,
+        speed: float = 1.0,
+        seed: int = 0,
+    ):
+        if interim_words < 1:
+            raise ValueError(f"interim_words must be at least 1, got {interim_words}")
+        if words_per_second <= 0:
+            raise ValueError(f"words_per_second must be positive, got {words_per_second}")
+        if not 0 <= jitter < 1:
+            raise ValueError(f"jitter must be in [0, 1), got {jitter}")
+        self.utterances = utterances  # {'speaker': ..., 'utterance': ...}
+        self.words_per_second = words_per_second
+        self.interim_words = interim_words
+        self.jitter = jitter
+        self.pause_seconds = pause_seconds
+        self.speed = speed
+        self.seed = seed
+
+    @classmethod
+    def from_jsonl(cls, path: str, **options) -> 'TranscriptReplaySource':
+        """Replay a `call_transcriptions.jsonl` file written by synthetic_call_transcription.py"""
+        with open(path, 'r') as file:
+            utterances = [json.loads(line) for line in file if line.strip()]
+        return cls(utterances, **options)
+
+    def events(self):
+        """The transcription events of the replay, each with its offset in seconds from the start of the call"""
+        rng = random.Random(self.seed)
+        speaker_ids = {}
+        clock = 0.0
+
+        def step(seconds):
+            return seconds * rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+        for utterance in self.utterances:
+            # Speakers are numbered in order of appearance, like the diarization of the live transcriber
+            speaker_id = speaker_ids.setdefault(utterance['speaker'], f"Guest-{len(speaker_ids) + 1}")
+            words = utterance['utterance'].split()
+            spoken = 0
+            for end in range(self.interim_words, len(words), self.interim_words):
+                clock += step((end - spoken) / self.words_per_second)
+                spoken = end
+                yield clock, {'text': " ".join(words[:end]), 'speaker_id': speaker_id, 'type': 'interim'}
+            clock += step((len(words) - spoken) / self.words_per_second)
+            yield clock, {'text': " ".join(words), 'speaker_id': speaker_id, 'type': 'final', 'audio_end': clock}
+            clock += step(self.pause_seconds)
+
+
+class ReplayTranscriber:
+    """Publishes the events of a transcript replay from a background thread; a stand-in for
+    the Speech SDK transcriber that needs no network"""
+    def __init__(self, source: TranscriptReplaySource, manager: TranscriptionManager, on_stopped=None):
+        self.source = source
+        self.manager = manager
+        self.on_stopped = on_stopped
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _replay(self):
+        start = time.perf_counter()
+        try:
+            for offset, transcription in self.source.events():
+                if self.source.speed > 0:
+                    delay = start + offset / self.source.speed - time.perf_counter()
+                    if delay > 0 and self._stop.wait(delay):
+                        break
+                elif self._stop.is_set():
+                    break
+                if transcription['type'] == 'final':
+                    transcription['published_at'] = time.perf_counter()
+                self.manager.publish(transcription)
+        finally:
+            # Ends the session like the transcriber's session_stopped event
+            self.manager.close()
+            if self.on_stopped:
+                self.on_stopped(None)
+
+    def start_transcribing_async(self):
+        self._thread = threading.Thread(target=self._replay, name="TranscriptReplay", daemon=True)
+        self._thread.start()
+
+    def stop_transcribing_async(self):
+        self._stop.set()
+
+
+def start_replay_transcription(source: TranscriptReplaySource, manager: TranscriptionManager, on_stopped=None) -> ReplayTranscriber:
+    """Start replaying a transcript into `manager` in the background.
+
+    Returns:
+        ReplayTranscriber: The running replay, to stop once the session has stopped.
+    """
+    replay_transcriber = ReplayTranscriber(source, manager, on_stopped)
+    replay_transcriber.start_transcribing_async()
+    return replay_transcriber
+
+def _create_transcriber(audio_config, manager: TranscriptionManager, on_stopped=None):
     # This example requires environment variables named "AZURE_SPEECH_KEY" and "AZURE_SPEECH_REGION"
     speech_config = speechsdk.SpeechConfig(
         subscription=os.environ.get('AZURE_SPEECH_KEY'), 
@@ -118,42 +433,95 @@ def recognize_from_file(file_path):
     )
 
     speech_config.set_property(speechsdk.PropertyId.Speech_SegmentationStrategy, "Semantic")
-    audio_config = speechsdk.audio.AudioConfig(filename=file_path)
     conversation_transcriber = speechsdk.transcription.ConversationTranscriber(
         speech_config=speech_config,
         audio_config=audio_config
     )
 
-    transcribing_stop = False
+    # Connect callbacks to the events
+    conversation_transcriber.transcribed.connect(partial(conversation_transcriber_transcribed_cb, manager))
+    conversation_transcriber.transcribing.connect(partial(conversation_transcriber_transcribing_cb, manager))
+    conversation_transcriber.session_started.connect(partial(conversation_transcriber_session_started_cb, manager))
+    conversation_transcriber.session_stopped.connect(partial(conversation_transcriber_session_stopped_cb, manager))
+    conversation_transcriber.canceled.connect(partial(conversation_transcriber_recognition_canceled_cb, manager))
+    if on_stopped:
+        conversation_transcriber.session_stopped.connect(on_stopped)
+        conversation_transcriber.canceled.connect(on_stopped)
+    return conversation_transcriber
 
-    def stop_cb(evt: speechsdk.SessionEventArgs):
-        print('CLOSING on {}'.format(evt))
-        nonlocal transcribing_stop
-        transcribing_stop = True
+def start_transcription(file_path, manager: TranscriptionManager, on_stopped=None):
+    """Start transcribing a file in the background.
 
-    # Connect callbacks to the events
-    conversation_transcriber.transcribed.connect(conversation_transcriber_transcribed_cb)
-    conversation_transcriber.transcribing.connect(conversation_transcriber_transcribing_cb)
-    conversation_transcriber.session_started.connect(conversation_transcriber_session_started_cb)
-    conversation_transcriber.session_stopped.connect(conversation_transcriber_session_stopped_cb)
-    conversation_transcriber.canceled.connect(conversation_transcriber_recognition_canceled_cb)
-    conversation_transcriber.session_stopped.connect(stop_cb)
-    conversation_transcriber.canceled.connect(stop_cb)
+    Transcriptions are published to `manager` until the session stops, then `on_stopped` is
+    called if given. Each call uses its own manager, so several calls can run in one process.
 
-    # Start the consumer thread
-    transcription_manager.start_consumer()
+    Returns:
+        ConversationTranscriber: The running transcriber, to stop once the session has stopped.
+    """
+    audio_config = speechsdk.audio.AudioConfig(filename=file_path)
+    conversation_transcriber = _create_transcriber(audio_config, manager, on_stopped)
 
     # Start transcribing
     conversation_transcriber.start_transcribing_async()
+    return conversation_transcriber
+
+def start_stream_transcription(source: PcmAudioSource, manager: TranscriptionManager, on_stopped=None, realtime: bool = False):
+    """Start transcribing a PCM source in the background, pushing its frames into the transcriber.
+
+    Nothing touches the disk. With `realtime`, frames are pushed at the pace they would arrive
+    from a live microphone or telephony stream.
+
+    Returns:
+        ConversationTranscriber: The running transcriber, to stop once the session has stopped.
+    """
+    stream_format = speechsdk.audio.AudioStreamFormat(
+        samples_per_second=source.sample_rate,
+        bits_per_sample=source.bits_per_sample,
+        channels=source.channels,
+    )
+    push_stream = speechsdk.audio.PushAudioInputStream(stream_format=stream_format)
+    audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
+    conversation_transcriber = _create_transcriber(audio_config, manager, on_stopped)
+
+    bytes_per_second = source.frame_bytes(1000)
+
+    def push_frames():
+        try:
+            for frame in source.frames:
+                # The SDK copies each frame into its own buffer
+                push_stream.write(bytes(frame))
+                if realtime:
+                    time.sleep(len(frame) / bytes_per_second)
+        except Exception as e:
+            print(f"Error while streaming audio: {e}")
+        finally:
+            # Closing the stream ends the session once the pushed audio is transcribed
+            push_stream.close()
+
+    conversation_transcriber.start_transcribing_async().get()
+    threading.Thread(target=push_frames, name="AudioPush", daemon=True).start()
+    return conversation_transcriber
+
+def recognize_from_file(file_path, manager: TranscriptionManager | None = None):
+    manager = manager or TranscriptionManager()
+    transcribing_stop = threading.Event()
+
+    def stop_cb(evt: speechsdk.SessionEventArgs):
+        print('CLOSING on {}'.format(evt))
+        transcribing_stop.set()
+
+    # Start the consumer thread
+    manager.start_consumer()
+
+    conversation_transcriber = start_transcription(file_path, manager, on_stopped=stop_cb)
 
     # Wait for completion
-    while not transcribing_stop:
-        time.sleep(.5)
+    transcribing_stop.wait()
 
     conversation_transcriber.stop_transcribing_async()
     
     # Stop and wait for the consumer thread to finish
-    transcription_manager.stop_consumer()
+    manager.stop_consumer()
 
 # Main execution
 if __name__ == "__main__":
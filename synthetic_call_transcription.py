@@ -3,9 +3,12 @@ from pydantic import BaseModel, Field
 from typing import Literal
 import dspy
 import os
+import io
+import threading
 import azure.cognitiveservices.speech as speechsdk
 from pydub import AudioSegment
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -58,66 +61,61 @@ class SyntheticCallTranscription(dspy.Signature):
     call_transcriptions: list[CallTranscription] = dspy.OutputField(desc="A list of call transcriptions between a client and a bank advisor based on the topic")
 
 
-def generate_audio_file(call_transcriptions, data_path):
-    advisor_utterances = [transcription.utterance for transcription in call_transcriptions if transcription.speaker == "advisor"]
-    customer_utterances = [transcription.utterance for transcription in call_transcriptions if transcription.speaker == "customer"]
+ADVISOR_VOICE = 'en-US-AvaMultilingualNeural'
+CUSTOMER_VOICE = 'en-US-AndrewMultilingualNeural'
+
+_synthesizers = threading.local()
+
+
+def get_synthesizer(voice: str) -> speechsdk.SpeechSynthesizer:
+    """Speech synthesizer for a voice, one per thread so utterances are synthesized concurrently"""
+    if not hasattr(_synthesizers, 'by_voice'):
+        _synthesizers.by_voice = {}
+    if voice not in _synthesizers.by_voice:
+        speech_config = speechsdk.SpeechConfig(
+            subscription=os.environ.get('AZURE_SPEECH_KEY'),
+            region=os.environ.get('AZURE_SPEECH_REGION')
+        )
+        speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)
+        speech_config.speech_synthesis_voice_name = voice
+        _synthesizers.by_voice[voice] = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+    return _synthesizers.by_voice[voice]
+
+
+def synthesize_utterance(transcription: CallTranscription) -> AudioSegment | None:
+    """Synthesize one utterance in its speaker's voice, in memory"""
+    voice = ADVISOR_VOICE if transcription.speaker == "advisor" else CUSTOMER_VOICE
+    result = get_synthesizer(voice).speak_text_async(transcription.utterance).get()
+    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+        # The RIFF output format makes the audio data a complete WAV file
+        return AudioSegment.from_wav(io.BytesIO(result.audio_data))
+    print(f"Error synthesizing {transcription.speaker} speech: {result.cancellation_details.reason}")
+    if result.cancellation_details.reason == speechsdk.CancellationReason.Error:
+        print(f"Error details: {result.cancellation_details.error_details}")
+    return None
+
+
+def generate_audio_file(call_transcriptions, data_path, tts_executor: ThreadPoolExecutor | None = None):
+    """Synthesize the utterances concurrently and export them, in conversation order, as the call recording.
+
+    `tts_executor` bounds the concurrent synthesis requests; share one across calls to bound them for a batch.
+    """
+    if tts_executor is None:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return generate_audio_file(call_transcriptions, data_path, executor)
+    segments = list(tts_executor.map(synthesize_utterance, call_transcriptions))
+    if any(segment is None for segment in segments):
+        # Not exported, so a re-run synthesizes the call again
+        raise RuntimeError(f"Failed to synthesize {segments.count(None)} of {len(segments)} utterances")
 
-    speech_config = speechsdk.SpeechConfig(
-        subscription=os.environ.get('AZURE_SPEECH_KEY'),
-        region=os.environ.get('AZURE_SPEECH_REGION')
-    )
-
-    advisor_synthetic_voice = 'en-US-AvaMultilingualNeural'
-    customer_synthetic_voice = 'en-US-AndrewMultilingualNeural'
-
-    speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)
-
-    # Configure advisor voice
-    speech_config.speech_synthesis_voice_name = advisor_synthetic_voice
-    advisor_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-
-    # Configure customer voice 
-    speech_config.speech_synthesis_voice_name = customer_synthetic_voice
-    customer_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-
-    # Synthesize advisor utterances
-    advisor_segments = []
-    for i, text in enumerate(advisor_utterances):
-        result = advisor_synthesizer.speak_text_async(text).get()
-        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            stream = speechsdk.AudioDataStream(result)
-            temp_file = f'advisor_utterance_{i}.wav'
-            stream.save_to_wav_file(temp_file)
-            advisor_segments.append(AudioSegment.from_wav(temp_file))
-            os.remove(temp_file)  # Clean up temporary file
-        else:
-            print(f"Error synthesizing advisor speech: {result.cancellation_details.reason}")
-            if result.cancellation_details.reason == speechsdk.CancellationReason.Error:
-                print(f"Error details: {result.cancellation_details.error_details}")
-
-    # Synthesize customer utterances  
-    customer_segments = []
-    for i, text in enumerate(customer_utterances):
-        result = customer_synthesizer.speak_text_async(text).get()
-        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            stream = speechsdk.AudioDataStream(result)
-            temp_file = f'customer_utterance_{i}.wav'
-            stream.save_to_wav_file(temp_file)
-            customer_segments.append(AudioSegment.from_wav(temp_file))
-            os.remove(temp_file)  # Clean up temporary file
-        else:
-            print(f"Error synthesizing customer speech: {result.cancellation_details.reason}")
-            if result.cancellation_details.reason == speechsdk.CancellationReason.Error:
-                print(f"Error details: {result.cancellation_details.error_details}")
-
-    # Combine all audio segments in conversation order
     combined_audio = AudioSegment.empty()
-    for advisor_segment, customer_segment in zip(advisor_segments, customer_segments):
-        combined_audio += advisor_segment
-        combined_audio += customer_segment
+    for segment in segments:
+        combined_audio += segment
 
-    # Export the combined audio
-    combined_audio.export(f"{data_path}/call_recording.wav", format="wav")
+    # Written under a temporary name, so an interrupted export is not taken for a finished recording
+    recording_path = os.path.join(data_path, "call_recording.wav")
+    combined_audio.export(f"{recording_path}.tmp", format="wav")
+    os.replace(f"{recording_path}.tmp", recording_path)
 
 
 class NoneRelevantNotesGenerator(dspy.Signature):
@@ -133,10 +131,71 @@ class NoneRelevantNotesGenerator(dspy.Signature):
     non_relevant_notes: list[str] = dspy.OutputField(desc="List of notes from previous calls unrelated to the current topic")
 
 
+def write_lines(path: str, lines: list[str]):
+    """Write a file under a temporary name first, so a file on disk is always complete"""
+    with open(f"{path}.tmp", 'w') as file:
+        for line in lines:
+            file.write(line + '\n')
+    os.replace(f"{path}.tmp", path)
+
+
+def generate_call(call_topic: str, tts_executor: ThreadPoolExecutor | None = None, output_dir: str = "synthetic_data"):
+    """Generate the transcription, notes and recording of a call about a topic.
+
+    Parts already in the topic's folder are kept, so an interrupted batch resumes where it stopped.
+    The notes and the recording only depend on the transcription, so they are generated concurrently.
+    """
+    data_path = os.path.join(output_dir, call_topic)
+    os.makedirs(data_path, exist_ok=True)
+    transcriptions_path = os.path.join(data_path, "call_transcriptions.jsonl")
+    notes_path = os.path.join(data_path, "call_notes.txt")
+    recording_path = os.path.join(data_path, "call_recording.wav")
+
+    if os.path.exists(transcriptions_path):
+        with open(transcriptions_path, 'r') as file:
+            call_transcriptions = [CallTranscription.model_validate_json(line) for line in file if line.strip()]
+    else:
+        transcription_generator = dspy.ChainOfThought(SyntheticCallTranscription)
+        call_transcriptions = transcription_generator(topic=call_topic, temperature=0.9).call_transcriptions
+        write_lines(transcriptions_path, [transcription.model_dump_json() for transcription in call_transcriptions])
+
+    def generate_notes():
+        none_relevant_notes_generator = dspy.ChainOfThought(NoneRelevantNotesGenerator)
+        non_relevant_notes = none_relevant_notes_generator(
+            topic=call_topic,
+            call_transcriptions=call_transcriptions,
+            temperature=0.9
+        ).non_relevant_notes
+        # get relevant notes from the call transcriptions and concatenate them
+        relevant_notes = [note for transcription in call_transcriptions for note in transcription.relevant_notes]
+        write_lines(notes_path, relevant_notes + non_relevant_notes)
+
+    with ThreadPoolExecutor(max_workers=1) as notes_executor:
+        notes = notes_executor.submit(generate_notes) if not os.path.exists(notes_path) else None
+        if not os.path.exists(recording_path):
+            generate_audio_file(call_transcriptions, data_path, tts_executor)
+        if notes is not None:
+            notes.result()
+
+
+def read_topics(topics_file: str) -> list[str]:
+    """Topics of a topics file, one per line; blank lines and lines starting with '#' are skipped"""
+    with open(topics_file, 'r') as file:
+        topics = [line.strip() for line in file]
+    return list(dict.fromkeys(topic for topic in topics if topic and not topic.startswith('#')))
+
+
 def main():
     parser = argparse.ArgumentParser(description='Generate synthetic call data')
-    parser.add_argument('--conversation-topic', type=str, required=True,
+    topic_group = parser.add_mutually_exclusive_group(required=True)
+    topic_group.add_argument('--conversation-topic', type=str,
                       help='The topic of the conversation')
+    topic_group.add_argument('--topics-file', type=str,
+                      help='File with one conversation topic per line, to generate a call for each')
+    parser.add_argument('--concurrency', type=int, default=4,
+                      help='Number of calls generated in parallel')
+    parser.add_argument('--tts-concurrency', type=int, default=8,
+                      help='Number of utterances synthesized in parallel, across all calls')
     args = parser.parse_args()
 
     # Load config
@@ -152,37 +211,22 @@ def main():
     )
     dspy.configure(lm=lm)
 
-    call_topic = args.conversation_topic
-
-    transcription_generator = dspy.ChainOfThought(SyntheticCallTranscription)
-    result = transcription_generator(topic=call_topic, temperature=0.9)
-
-    none_relevant_notes_generator = dspy.ChainOfThought(NoneRelevantNotesGenerator)
-    non_relevant_notes = none_relevant_notes_generator(
-        topic=call_topic, 
-        call_transcriptions=result.call_transcriptions,
-        temperature=0.9
-    ).non_relevant_notes
-
-    # get relevant notes from the call transcriptions and concatenate them
-    relevant_notes = [note for transcription in result.call_transcriptions for note in transcription.relevant_notes]
-    total_notes = relevant_notes + non_relevant_notes
-
-    # create a folder for the topic if it doesn't exist
-    data_path = f"synthetic_data/{call_topic}"
-    if not os.path.exists(data_path):
-        os.makedirs(data_path)
-
-    # save transcriptions to jsonl
-    with open(f'{data_path}/call_transcriptions.jsonl', 'w') as file:
-        for transcription in result.call_transcriptions:
-            file.write(transcription.model_dump_json() + '\n')
-
-    with open(f'{data_path}/call_notes.txt', 'w') as file:
-        for note in total_notes:
-            file.write(note + '\n')
-
-    generate_audio_file(result.call_transcriptions, data_path)
+    topics = [args.conversation_topic] if args.conversation_topic else read_topics(args.topics_file)
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.tts_concurrency) as tts_executor, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as call_executor:
+        futures = {call_executor.submit(generate_call, topic, tts_executor): topic for topic in topics}
+        for future in as_completed(futures):
+            topic = futures[future]
+            try:
+                future.result()
+                print(f"Generated call: {topic}")
+            except Exception as e:
+                print(f"Error generating call {topic}: {e}")
+                failed.append(topic)
+    print(f"Generated {len(topics) - len(failed)} of {len(topics)} calls")
+    if failed:
+        print(f"Re-run to resume the failed topics: {failed}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
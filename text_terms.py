@@ -0,0 +1,13 @@
+import re
+
+STOPWORDS = {
+    "a", "an", "and", "are", "about", "as", "at", "be", "but", "by", "can", "could", "do", "for", "from",
+    "have", "hi", "how", "i", "i'm", "if", "in", "is", "it", "me", "my", "of", "on", "or", "so", "that",
+    "the", "this", "to", "want", "was", "we", "what", "with", "would", "you", "your",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased content words, with a trailing plural 's' removed"""
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words if word not in STOPWORDS]
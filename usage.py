@@ -0,0 +1,103 @@
+import time
+import threading
+from contextlib import contextmanager
+import dspy
+from dspy.utils.callback import BaseCallback
+
+
+class Usage:
+    """Thread-safe totals of LM calls: count, prompt and completion tokens, cost and latency"""
+    def __init__(self):
+        self.lm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.lm_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, lm_calls: int, prompt_tokens: int, completion_tokens: int, cost: float, seconds: float):
+        with self._lock:
+            self.lm_calls += lm_calls
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            self.lm_seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'lm_calls': self.lm_calls,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cost': self.cost,
+                'lm_seconds': self.lm_seconds,
+            }
+
+
+class LMTimer(BaseCallback):
+    """Sums the latency of the LM calls it sees"""
+    def __init__(self):
+        self.seconds = 0.0
+        self._starts = {}  # call id -> start time
+        self._lock = threading.Lock()
+
+    def on_lm_start(self, call_id, instance, inputs):
+        with self._lock:
+            self._starts[call_id] = time.perf_counter()
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        with self._lock:
+            start = self._starts.pop(call_id, None)
+            if start is not None:
+                self.seconds += time.perf_counter() - start
+
+
+# LM model -> the model litellm prices it as, for Azure deployments not named after their model
+pricing_models = {}
+_unpriced_models = set()
+
+
+def token_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """USD cost of the tokens at litellm's list price of the model, or of the model it is priced as.
+
+    A model litellm has no price for costs 0, with a warning the first time, since its calls
+    then never count toward a call budget.
+    """
+    import litellm
+    pricing_model = pricing_models.get(model, model)
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(model=pricing_model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    except Exception as e:
+        if pricing_model not in _unpriced_models:
+            _unpriced_models.add(pricing_model)
+            print(f"Warning: no price known for {pricing_model} ({type(e).__name__}), its LM calls are counted as free "
+                  f"and never reach a call budget; map the deployment to a priced model under `pricing_models` in config.yaml")
+        return 0.0
+    return prompt_cost + completion_cost
+
+
+@contextmanager
+def metered(*meters: Usage):
+    """Add the LM calls made inside the block, in this task or thread, to `meters`.
+
+    Tokens come from dspy's usage tracking, which is context-local, so concurrent windows
+    sharing an LM are metered apart; `lm.history` is shared and could not tell them apart.
+    Nested blocks each add the calls to their own meters.
+    """
+    timer = LMTimer()
+    with dspy.context(track_usage=True, callbacks=[*dspy.settings.callbacks, timer]), dspy.track_usage() as tracker:
+        try:
+            yield
+        finally:
+            lm_calls = prompt_tokens = completion_tokens = 0
+            cost = 0.0
+            for model, entries in tracker.usage_data.items():
+                model_prompt_tokens = sum(entry.get('prompt_tokens') or 0 for entry in entries)
+                model_completion_tokens = sum(entry.get('completion_tokens') or 0 for entry in entries)
+                lm_calls += len(entries)
+                prompt_tokens += model_prompt_tokens
+                completion_tokens += model_completion_tokens
+                if model_prompt_tokens or model_completion_tokens:
+                    cost += token_cost(model, model_prompt_tokens, model_completion_tokens)
+            for meter in meters:
+                meter.add(lm_calls, prompt_tokens, completion_tokens, cost, timer.seconds)